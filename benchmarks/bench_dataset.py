@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+"""Benchmarks of quirks.dataset hot paths.
+
+Every operation is run in its own child process on synthetic data, so the
+reported peak memory belongs to the operation alone. Results are printed and
+optionally written as JSON together with the commit they were measured on,
+two such files can be compared by '--compare'.
+
+Example:
+    python benchmarks/bench_dataset.py --rows 1000000 --cols 8 -o base.json
+    git checkout feature
+    python benchmarks/bench_dataset.py --rows 1000000 --cols 8 -o new.json --compare base.json
+
+"""
+
+import os
+import sys
+import json
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+def make_table(rows, cols, dtype='float64', keys=1000, seed=0):
+    """Return synthetic Table with field 'key' of 'keys' distinct values and 'cols' uniform fields f0, f1, ..."""
+    from numpy import empty
+    from numpy.random import RandomState
+    from quirks.dataset import Table
+    random = RandomState(seed)
+    data = empty((rows,cols+1), dtype=dtype)
+    data[:,0] = random.randint(0,keys,rows)
+    data[:,1:] = random.rand(rows,cols) * (100 if data.dtype.kind in 'iu' else 1)
+    return Table(data=data, fields=('key',)+tuple('f%d' % i for i in xrange(cols)))
+
+def make_h5(path, rows, cols, dtype='float64', groups=100, compression=None, seed=0):
+    """Create HDF5 file 'path' holding synthetic table 'table' and 'groups' small tables under 'tree'."""
+    from quirks.dataset import H5Node
+    h5 = H5Node(path, mode='w', compression=compression)
+    try:
+        make_table(rows, cols, dtype, seed=seed).save(h5['table'])
+        for i in xrange(groups):
+            make_table(16, cols, dtype, seed=seed+i).save(h5['tree/g%d/t%d' % (i % 10, i)])
+    finally:
+        h5.close()
+
+def _threshold(cfg):
+    return 50 if cfg.dtype.startswith(('int','uint')) else 0.5
+
+def _op_select(cfg, t):
+    p = t.f0 > _threshold(cfg)
+    return lambda: t.select(p), len(t)
+def _op_select_fields(cfg, t):
+    p = t.f0 > _threshold(cfg)
+    return lambda: t.select(p, fields=('f0','key')), len(t)
+def _op_select_order(cfg, t):
+    p = t.f0 > _threshold(cfg)
+    return lambda: t.select(p, order='f1'), len(t)
+def _op_select_topk(cfg, t):
+    return lambda: t.select(None, order='f1', limit=100, descending=True), len(t)
+def _op_select_index(cfg, t):
+    t.create_index('key')
+    return lambda: t.select((t.key >= 10) & (t.key < 20)), len(t)
+def _op_get_indexing(cfg, t):
+    p = (t.f0 > _threshold(cfg)) & (t.key < 500)
+    return lambda: t._get_indexing(p, ('f0','key')), len(t)
+def _op_predicate(cfg, t):
+    p = ((t.f0 > _threshold(cfg)) & (t.key < 500)) | (t.key == 7)
+    kernel = p.compile()
+    return lambda: kernel(t.data, t._getfield), len(t)
+def _op_add(cfg, t):
+    from quirks.dataset import Table
+    u = Table(data=t.data.copy(), fields=t.fields)
+    return lambda: Table(data=t.data, fields=t.fields) + u, 2*len(t)
+def _op_add_field(cfg, t):
+    from quirks.dataset import Table
+    return lambda: Table(data=t.data, fields=t.fields).add_field('extra', 0), len(t)
+def _op_set_fields(cfg, t):
+    p = t.f0 > _threshold(cfg)
+    return lambda: t.set_fields(p, ('f1',), 0), len(t)
+def _op_groupby(cfg, t):
+    return lambda: t.groupby('key').agg(count=True, sum='f0', max='f1'), len(t)
+def _op_join(cfg, t):
+    right = make_table(1000, 2, cfg.dtype, keys=1000, seed=1)
+    right.set_fields(None, ('key',), lambda k: k[:,0].argsort().argsort()[:,None])
+    return lambda: t.join(right, 'key'), len(t)
+def _op_save(cfg, t):
+    from quirks.dataset import H5Node
+    path = os.path.join(cfg.tmpdir, 'save.h5')
+    def save():
+        h5 = H5Node(path, mode='w', compression=cfg.compression)
+        try:
+            t.save(h5['table'])
+        finally:
+            h5.close()
+    return save, len(t)
+def _op_h5_scan(cfg, t):
+    from quirks.dataset import H5Node
+    h5 = H5Node(cfg.h5, mode='r', chunksize=cfg.chunksize)
+    table = h5['table']
+    p = table.f0 > _threshold(cfg)
+    return lambda: table.select(p), len(table)
+def _op_h5_traverse(cfg, t):
+    from quirks.dataset import H5Node
+    h5 = H5Node(cfg.h5, mode='r')
+    # only the small tables under 'tree', the root holds also the big 'table'
+    tree = h5.child('tree')
+    def walk(node):
+        count = 0
+        for key,value in node.iteritems():
+            count += 1 + (walk(value) if isinstance(value,H5Node) else 0)
+        return count
+    return lambda: walk(tree), cfg.groups
+
+OPS = ( 'select', 'select_fields', 'select_order', 'select_topk', 'select_index', 'get_indexing',
+        'predicate', 'add', 'add_field', 'set_fields', 'groupby', 'join', 'save', 'h5_scan', 'h5_traverse' )
+
+def _maxrss():
+    """return peak resident memory of this process in MB"""
+    import resource
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024.*1024 if sys.platform == 'darwin' else 1024.)
+
+def _measure(op, cfg, queue):
+    """run 'op' in the child process, put its result to 'queue'"""
+    try:
+        t = make_table(cfg.rows, cfg.cols, cfg.dtype) if not op.startswith('h5_') else None
+        fnc,rows = globals()['_op_' + op](cfg, t)
+        base = _maxrss()
+        times = []
+        for i in xrange(cfg.repeat):
+            start = time.time()
+            fnc()
+            times.append(time.time() - start)
+        best = min(times)
+        queue.put({ 'seconds': best, 'rows': rows,
+                    'rows_per_sec': rows / best if best > 0 else float('inf'),
+                    'peak_mb': _maxrss(), 'op_mb': _maxrss() - base })
+    except Exception, e:
+        queue.put({ 'error': '%s: %s' % (e.__class__.__name__, e) })
+
+def run(cfg):
+    """Run operations 'cfg.ops', return dict of results"""
+    from multiprocessing import Process,Queue
+    results = {}
+    for op in cfg.ops:
+        queue = Queue()
+        child = Process(target=_measure, args=(op,cfg,queue))
+        child.start()
+        results[op] = queue.get()
+        child.join()
+        r = results[op]
+        if 'error' in r:
+            print '%-14s %s' % (op, r['error'])
+        else:
+            print '%-14s %12.0f rows/s %10.4f s %9.1f MB peak %9.1f MB op' % (op, r['rows_per_sec'], r['seconds'], r['peak_mb'], r['op_mb'])
+    return results
+
+def _commit():
+    from subprocess import Popen,PIPE
+    try:
+        out = Popen(['git','rev-parse','HEAD'], stdout=PIPE, stderr=PIPE, cwd=os.path.dirname(os.path.abspath(__file__))).communicate()[0]
+        return out.strip() or None
+    except OSError:
+        return None
+
+def _versions():
+    import platform
+    versions = { 'python': platform.python_version() }
+    for name in ('numpy','tables','numexpr'):
+        try:
+            versions[name] = __import__(name).__version__
+        except ImportError:
+            versions[name] = None
+    return versions
+
+def compare(base, new, tolerance=0.1):
+    """Print throughput of 'new' relative to 'base' results, return list of regressed operations."""
+    regressed = []
+    print '%-14s %14s %14s %8s' % ('op', 'base rows/s', 'new rows/s', 'ratio')
+    for op in sorted(set(base['results']) & set(new['results'])):
+        b,n = base['results'][op],new['results'][op]
+        if 'error' in b or 'error' in n:
+            continue
+        ratio = n['rows_per_sec'] / b['rows_per_sec']
+        if ratio < 1 - tolerance:
+            regressed.append(op)
+        print '%-14s %14.0f %14.0f %7.2fx%s' % (op, b['rows_per_sec'], n['rows_per_sec'], ratio, ' !' if op in regressed else '')
+    return regressed
+
+def main(argv=None):
+    import argparse
+    import tempfile
+    import shutil
+    parser = argparse.ArgumentParser(description='Benchmarks of quirks.dataset')
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--cols', type=int, default=8)
+    parser.add_argument('--dtype', default='float64')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--chunksize', type=int, default=1<<16, help='block size of chunked HDF5 scan')
+    parser.add_argument('--groups', type=int, default=100, help='number of groups of generated HDF5 file')
+    parser.add_argument('--compression', default=None, help="compression library of HDF5 file, e.g. 'blosc'")
+    parser.add_argument('--h5', default=None, help='HDF5 file to use, it is generated if it does not exist')
+    parser.add_argument('--ops', nargs='+', default=OPS, choices=OPS)
+    parser.add_argument('-o', '--output', default=None, help='write results to JSON file')
+    parser.add_argument('--compare', default=None, help='JSON results to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='relative slowdown reported as regression')
+    cfg = parser.parse_args(argv)
+
+    cfg.tmpdir = tempfile.mkdtemp(prefix='bench_dataset')
+    try:
+        if cfg.h5 is None:
+            cfg.h5 = os.path.join(cfg.tmpdir, 'bench.h5')
+        if any(op.startswith('h5_') for op in cfg.ops) and not os.path.exists(cfg.h5):
+            make_h5(cfg.h5, cfg.rows, cfg.cols, cfg.dtype, cfg.groups, cfg.compression)
+        results = run(cfg)
+    finally:
+        shutil.rmtree(cfg.tmpdir, ignore_errors=True)
+
+    report = { 'commit': _commit(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'versions': _versions(),
+               'config': dict((k,getattr(cfg,k)) for k in ('rows','cols','dtype','repeat','chunksize','groups','compression')),
+               'results': results }
+    if cfg.output:
+        with open(cfg.output,'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    if cfg.compare:
+        with open(cfg.compare) as f:
+            return 1 if compare(json.load(f), report, cfg.tolerance) else 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
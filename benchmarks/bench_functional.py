@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+"""Micro-benchmarks of quirks.functional, per-call time against hand-written code.
+
+Example:
+    python benchmarks/bench_functional.py --number 1000000
+
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+def cases():
+    """Return list of (name, callable, hand-written equivalent, arguments)"""
+    from quirks.functional import combinator,maybe
+    inc = lambda x: x + 1
+    dbl = lambda x: x * 2
+    neg = lambda x: -x
+    def parse(s):
+        try:
+            return int(s)
+        except Exception:
+            try:
+                return float(s)
+            except Exception:
+                return None
+    return [
+        ('combinator/2',   combinator(inc,dbl),                    lambda x: inc(dbl(x)),             (3,)),
+        ('combinator/3',   combinator(inc,combinator(dbl,neg)),    lambda x: inc(dbl(neg(x))),        (3,)),
+        ('combinator/5',   combinator(inc,dbl,neg,inc,dbl),        lambda x: inc(dbl(neg(inc(dbl(x))))), (3,)),
+        ('maybe',          maybe(int,float),                       parse,                             ('2.5',)),
+        ('maybe/cache',    maybe(int,float,cache=True),            parse,                             ('2.5',)),
+    ]
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='Micro-benchmarks of quirks.functional')
+    parser.add_argument('--number', type=int, default=200000, help='calls per measurement')
+    parser.add_argument('--repeat', type=int, default=3)
+    cfg = parser.parse_args(argv)
+    print '%-14s %10s %12s %9s' % ('case', 'ns/call', 'hand ns/call', 'overhead')
+    for name,fnc,hand,args in cases():
+        assert fnc(*args) == hand(*args), name
+        t = min(timeit.repeat(lambda: fnc(*args), number=cfg.number, repeat=cfg.repeat))
+        h = min(timeit.repeat(lambda: hand(*args), number=cfg.number, repeat=cfg.repeat))
+        print '%-14s %10.1f %12.1f %8.2fx' % (name, 1e9*t/cfg.number, 1e9*h/cfg.number, t/h)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+"""Import time of quirks modules.
+
+Every module is imported in a fresh interpreter, best time of '--repeat' runs
+is reported together with heavy dependencies the import loaded.
+
+Example:
+    python benchmarks/bench_import.py --repeat 10 -o import.json
+
+"""
+
+import os
+import sys
+import json
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+MODULES = ('quirks.dataset', 'quirks.colorize', 'quirks.functional', 'quirks.iterable',
+           'quirks.distance', 'quirks.profiling', 'quirks.lazy')
+HEAVY = ('numpy', 'tables', 'numexpr', 'fabulous')
+
+PROBE = '''
+import sys, time, json
+sys.path.insert(0, %r)
+start = time.time()
+import %s
+seconds = time.time() - start
+print json.dumps({'seconds': seconds, 'loaded': [m for m in %r if m in sys.modules]})
+'''
+
+def measure(module, repeat=5, python=sys.executable):
+    """Return best import time of 'module' in seconds and heavy modules it loaded."""
+    from subprocess import Popen,PIPE
+    best,loaded = None,None
+    for i in xrange(repeat):
+        out,err = Popen([python, '-c', PROBE % (ROOT, module, HEAVY)], stdout=PIPE, stderr=PIPE).communicate()
+        try:
+            result = json.loads(out.strip().splitlines()[-1])
+        except (ValueError,IndexError):
+            raise RuntimeError('import of %s failed:\n%s' % (module, err))
+        if best is None or result['seconds'] < best:
+            best = result['seconds']
+        loaded = result['loaded']
+    return best,loaded
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='Import time of quirks modules')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--modules', nargs='+', default=MODULES)
+    parser.add_argument('-o', '--output', default=None, help='write results to JSON file')
+    cfg = parser.parse_args(argv)
+    results = {}
+    print '%-20s %10s  %s' % ('module', 'ms', 'loaded')
+    for module in cfg.modules:
+        try:
+            seconds,loaded = measure(module, cfg.repeat)
+        except RuntimeError, e:
+            print '%-20s %s' % (module, str(e).splitlines()[-1])
+            results[module] = { 'error': str(e) }
+            continue
+        results[module] = { 'seconds': seconds, 'loaded': loaded }
+        print '%-20s %10.2f  %s' % (module, 1e3*seconds, ','.join(loaded))
+    if cfg.output:
+        with open(cfg.output,'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,51 +1,113 @@
+import re
+from functional import combinator
 
-try:
-    from fabulous.color import bold,italic,underline,strike,blink,flip, \
-                                black,red,green,yellow,blue,magenta,cyan,white ,\
-                                highlight_black,highlight_red,highlight_green,highlight_yellow,highlight_blue,\
-                                highlight_magenta,highlight_cyan,highlight_white
-    from functional import *
-    boldblack = combinator(bold ,black)
-    boldred = combinator(bold ,red)
-    boldgreen = combinator(bold ,green)
-    boldyellow = combinator(bold ,yellow)
-    boldblue = combinator(bold ,blue)
-    boldmagenta = combinator(bold ,magenta)
-    boldcyan = combinator(bold ,cyan)
-    boldwhite = combinator(bold ,white)
-    eraserest = lambda x:'\033[K'
-except ImportError:
-    print 'fabulous not found, colors are disabled'
-    highlight_black=highlight_red=highlight_green=highlight_yellow=highlight_blue=\
-    highlight_magenta=highlight_cyan=highlight_white=bold=italic=underline=strike=\
-    blink=flip=black=red=green=yellow=blue=magenta=cyan=white =\
-    boldblack,boldred,boldgreen,boldyellow,boldblue,boldmagenta,boldcyan,boldwhite = lambda x:x
-    
+_fabulous = []
 
+def _color_module():
+    """return fabulous.color, it is imported on first use, None if it is not installed"""
+    if not _fabulous:
+        try:
+            import fabulous.color as module
+        except ImportError:
+            import warnings
+            warnings.warn('fabulous not found, colors are disabled')
+            module = None
+        _fabulous.append(module)
+    return _fabulous[0]
+
+class _color(object):
+    """color 'name' of fabulous.color loaded on first call, identity if fabulous is not installed"""
+    __slots__ = ('name','fnc')
+    def __init__(self, name):
+        self.name = name
+        self.fnc = None
+    def __call__(self, s):
+        if self.fnc is None:
+            module = _color_module()
+            self.fnc = getattr(module,self.name) if module is not None else (lambda x:x)
+        return self.fnc(s)
+
+bold,italic,underline,strike,blink,flip = \
+    [ _color(c) for c in ('bold','italic','underline','strike','blink','flip') ]
+black,red,green,yellow,blue,magenta,cyan,white = \
+    [ _color(c) for c in ('black','red','green','yellow','blue','magenta','cyan','white') ]
+highlight_black,highlight_red,highlight_green,highlight_yellow,highlight_blue,highlight_magenta,highlight_cyan,highlight_white = \
+    [ _color('highlight_'+c) for c in ('black','red','green','yellow','blue','magenta','cyan','white') ]
+boldblack = combinator(bold ,black)
+boldred = combinator(bold ,red)
+boldgreen = combinator(bold ,green)
+boldyellow = combinator(bold ,yellow)
+boldblue = combinator(bold ,blue)
+boldmagenta = combinator(bold ,magenta)
+boldcyan = combinator(bold ,cyan)
+boldwhite = combinator(bold ,white)
+eraserest = lambda x:'\033[K'
+
+def _affixes(color):
+    """return (prefix, suffix) the 'color' wraps a text with, None if it does not just wrap it"""
+    if not callable(color):
+        return None
+    probes = u'\x00a\x00', u'\x00b\x00'
+    try:
+        outputs = [ unicode(color(p)) for p in probes ]
+    except Exception:
+        return None
+    parts = outputs[0].split(probes[0])
+    if len(parts) != 2 or outputs[1] != parts[0] + probes[1] + parts[1]:
+        return None
+    return tuple(parts)
 
 class colorize(object):
+    """Apply 'colors' in order to placeholders of the template.
+
+    Placeholders are format specifications (e.g. '%5d'), text enclosed in '#'
+    (the hashes are dropped) and '##'. Placeholders left without color are not
+    changed. Rendered templates are kept in LRU cache of 'cachesize' entries,
+    so repeated template is colorized only once.
+
+    Example:
+        print (colorize(boldred,blue) * '#error# in %s') % path
+
+    """
+    # format mini-language
+    fml = re.compile(r'(?:(##)|#([^#]+)#|(%(?:[^{}]?(?:<|>|\+|^))?(?:\+|-|\s)?#?0?(?:[0-9]+)?,?(?:[.][0-9]+)?(?:b|c|d|e|E|f|F|g|G|n|o|s|x|X)))')
+    cachesize = 256
     def __init__(self,*colors):
-        import re
+        from collections import OrderedDict
         self.colors = colors
-        # format mini-language
-        self.fml = re.compile(r'(?:(##)|#([^#]+)#|(%(?:[^{}]?(?:<|>|\+|^))?(?:\+|-|\s)?#?0?(?:[0-9]+)?,?(?:[.][0-9]+)?(?:b|c|d|e|E|f|F|g|G|n|o|s|x|X)))')
+        self._affixes = [ _affixes(c) for c in colors ]
+        self._cache = OrderedDict()
     def __iter__(self):
         return iter(self.colors)
-    def _rainbow(self):
-        class Rainbow:
-            def __init__(self,iter):
-                self.iter = iter
-            def _apply_color(self,s):
-                try:
-                    color = self.iter.next()
-                    return unicode(color(s)) if callable(color) else s
-                except StopIteration:
-                    return s
-            def __call__(self, matcher):
-                return self._apply_color(reduce(lambda a,x:x,filter(None,matcher.groups()),None))
-
-
-        return Rainbow(iter(self))
-
+    def _compile(self, template):
+        """return list of segments of colorized 'template', color escapes are plain strings"""
+        segments,pos = [],0
+        for i,m in enumerate(self.fml.finditer(template)):
+            segments.append(template[pos:m.start()])
+            text = [ g for g in m.groups() if g ][-1]
+            color = self.colors[i] if i < len(self.colors) else None
+            if not callable(color):
+                segments.append(text)
+            elif self._affixes[i] is None:
+                segments.append(unicode(color(text)))
+            else:
+                segments.extend((self._affixes[i][0],unicode(text),self._affixes[i][1]))
+            pos = m.end()
+        segments.append(template[pos:])
+        return segments
+    def render(self, template, args=None):
+        """Return colorized 'template', formatted by 'args' if given."""
+        try:
+            result = self._cache.pop(template)
+        except KeyError:
+            result = ''.join(self._compile(template))
+            while len(self._cache) >= self.cachesize:
+                self._cache.popitem(last=False)
+        self._cache[template] = result
+        return result if args is None else result % args
+    def render_many(self, lines):
+        """Return list of colorized 'lines', each is a template or pair of template and its arguments."""
+        render = self.render
+        return [ render(l) if isinstance(l,basestring) else render(*l) for l in lines ]
     def __mul__(self, s):
-        return self.fml.sub(self._rainbow(),s)
+        return self.render(s)
@@ -2,7 +2,33 @@
 
 """
 
-from util import *
+from operator import isSequenceType,and_,or_,xor,eq
+from profiling import instrument,note
+import lazy
+
+# heavy dependencies are imported on first use
+numpy = lazy.module('numpy')
+tables = lazy.module('tables')
+numexpr = lazy.module('numexpr') if lazy.available('numexpr') else None
+
+def scalar(node):
+    """return value of the leaf 'node' holding single element, other nodes are returned as they are"""
+    if getattr(node,'shape',None) in ((),(1,)):
+        value = node.read()
+        if isinstance(value,list) and len(value) == 1:
+            # python flavor of array stored from a sequence
+            value = value[0]
+        return value.item() if hasattr(value,'item') else value
+    return node
+
+_pools = {}
+def _thread_pool(workers):
+    """return shared pool of 'workers' threads"""
+    from multiprocessing.pool import ThreadPool
+    pool = _pools.get(workers)
+    if pool is None:
+        pool = _pools[workers] = ThreadPool(workers)
+    return pool
 
 class H5Node(object):
     """Creates group in H5 file.
@@ -18,38 +44,77 @@ class H5Node(object):
         An instance of H5 group
     auto_create_grps : boolean
         if True ne group is created if it is non-existent
+    chunksize : int
+        if set, tables are not loaded into memory but streamed from the file
+        in blocks of 'chunksize' rows (see Table)
+    mode : string
+        mode the file is opened in if 'h5' is not provided
+    compression : string
+        compression library ('blosc', 'zlib', 'lzo', 'bzip2') used to store arrays by
+        '__setitem__', if not set arrays are stored uncompressed (see store)
+    complevel : int
+        compression level
+
+    Handles of looked up children are kept in LRU cache of 'cachesize'
+    entries, together with the kind of content of child groups. Cache is
+    invalidated by '__setitem__' and '__delitem__' of this node or its
+    children, also of child nodes already evicted from the cache. Handles of
+    nodes closed by other changes of the file are looked up again.
 
     """
-    def __init__(self, opt, h5 = None, grp = None, auto_create_grps = True ):
+    cachesize = 128
+    def __init__(self, opt, h5 = None, grp = None, auto_create_grps = True, chunksize = None, mode = 'a',
+                 compression = None, complevel = 5 ):
         from tables import openFile,File
+        from collections import OrderedDict
+        from weakref import WeakKeyDictionary
         if isinstance(h5,File):
             self.h5 = h5
         else:
             db = opt if isinstance(opt,str) else  opt.database
-            self.h5 = openFile(db,'a')
+            self.h5 = openFile(db,mode)
         self.group = self.h5.root if grp is None else grp
         self.opt = opt
         self.auto_create_grps = auto_create_grps
+        self.chunksize = chunksize
+        self.compression = compression
+        self.complevel = complevel
+        self._cache = OrderedDict()
+        self._children = WeakKeyDictionary()
+        self._parent = None
     def _keyfnc(self,g):
         return g._v_pathname.rsplit('/',1)[-1]
     def _itemfnc(self,g):
         return self._keyfnc(g),self._get_item(g)
     def __len__(self):
-        return len(self.keys())
+        return self.group._v_nchildren
     def __iter__(self):
         from itertools import imap
         return imap(self._keyfnc,self.h5.iterNodes(self.group))
     def __reversed__(self):
         return reversed(self.keys())
-    def iteritems(self):
+    def iteritems(self, prefetch=None):
+        """Iterate over (key, child) pairs.
+
+        If 'prefetch' is set, children are read by a background thread at most
+        'prefetch' children ahead, so reading of the next tables overlaps the
+        processing of the current one. Tables are then always loaded into memory.
+        The file must not be accessed by other threads until the iteration ends.
+        """
         from itertools import imap
-        return imap(self._itemfnc,self.h5.iterNodes(self.group))
+        items = imap(self._itemfnc,self.h5.iterNodes(self.group))
+        if not prefetch:
+            return items
+        return _prefetch(((k,v.load() if isinstance(v,Table) else v) for k,v in items), prefetch)
     def has_key(self,key):
         return key in self
     def iterkeys(self):
         return iter(self)
-    def itervalues(self):
+    def itervalues(self, prefetch=None):
+        """Iterate over children, see iteritems for 'prefetch'."""
         from itertools import imap
+        if prefetch:
+            return imap(lambda item: item[1], self.iteritems(prefetch))
         return imap(self._get_item,self.h5.iterNodes(self.group))
     def keys(self):
         return  [ i for i in iter(self) ]
@@ -60,26 +125,85 @@ class H5Node(object):
     def get(self,key,d=None):
         return self[key] if key in self else d
     def __contains__(self, item):
-        from tables import NoSuchNodeError
         try:
-            self.h5.getNode(self.group,item)
+            self._node(item)
             return True
-        except NoSuchNodeError:
+        except tables.NoSuchNodeError:
             return False
     def __delitem__(self, key):
-        self.h5.getNode(self.group,key)._f_remove(True)
+        node = self._node(key)
+        pathname = node._v_pathname
+        node._f_remove(True)
+        self._invalidate(pathname)
     def _get_item(self,item):
-        from tables import Node,Group
-        if isinstance(item,Node):
-            if isinstance(item,Group):
-                result = H5Node(self.opt,h5=self.h5, grp=item)
-                if 'data' in result and 'fields' in result:
-                    return Table(h5=result)
+        if isinstance(item,tables.Node):
+            if isinstance(item,tables.Group):
+                result,kind = self._resolve(item)
+                if kind is Table:
+                    return Table(h5=result, chunksize=self.chunksize)
+                elif kind is ColumnTable:
+                    return ColumnTable(h5=result)
                 else:
                     return result
             else:
                 return scalar(item)
 
+    def _resolve(self, group):
+        """return H5Node of child 'group' and kind of its content (Table, ColumnTable or H5Node)"""
+        entry = self._cached(group._v_pathname)
+        if entry is None:
+            entry = self._cache_put(group._v_pathname, [group,None])
+        if entry[1] is None:
+            result = H5Node(self.opt,h5=self.h5, grp=group, chunksize=self.chunksize,
+                            compression=self.compression, complevel=self.complevel)
+            result._parent = self
+            self._children[result] = group._v_pathname
+            if 'data' in result and 'fields' in result:
+                kind = Table
+            elif 'columns' in result and 'fields' in result:
+                kind = ColumnTable
+            else:
+                kind = H5Node
+            entry[1] = result,kind
+        return entry[1]
+
+    def _cached(self, pathname):
+        """return cache entry [node, resolved content] of 'pathname' or None"""
+        entry = self._cache.pop(pathname,None)
+        if entry is not None and entry[0]._v_isopen:
+            self._cache[pathname] = entry
+            return entry
+        return None
+
+    def _cache_put(self, pathname, entry):
+        self._cache[pathname] = entry
+        if len(self._cache) > self.cachesize:
+            self._cache.popitem(last=False)
+        return entry
+
+    def _invalidate(self, pathname, up=True):
+        """drop cached nodes under 'pathname' and resolved content of its ancestors,
+           child nodes evicted from the cache are reached through weak registry"""
+        for key,entry in self._cache.items():
+            if key == pathname or key.startswith(pathname + '/'):
+                del self._cache[key]
+            elif pathname.startswith(key.rstrip('/') + '/') and entry[1] is not None:
+                entry[1] = None
+        for child,key in self._children.items():
+            if key == pathname or key.startswith(pathname + '/') or pathname.startswith(key.rstrip('/') + '/'):
+                child._invalidate(pathname, up=False)
+        if up and self._parent is not None:
+            self._parent._invalidate(pathname)
+
+    def _node(self, key):
+        """Return the raw PyTables node stored under 'key'."""
+        path,name = self._get_absolute_path(key)
+        pathname = path.rstrip('/') + '/' + name
+        entry = self._cached(pathname)
+        if entry is None:
+            entry = self._cache_put(pathname, [self.h5.getNode(path,name),None])
+        return entry[0]
+
     def _get_current_path(self):
         if self._is_root():
             return '/'
@@ -104,25 +228,121 @@ class H5Node(object):
             path = self._get_current_path()
         return  path,name
 
+    def _lookup(self, key):
+        """return node 'key', group is created if it does not exist and 'auto_create_grps' is set"""
+        try:
+            return self._node(key)
+        except tables.NoSuchNodeError:
+            if not self.auto_create_grps:
+                raise
+            path,name = self._get_absolute_path(key)
+            node =  self.h5.createGroup(path,name,createparents=True)
+            self._invalidate(node._v_pathname)
+            return node
+    @instrument('H5Node.__getitem__')
     def __getitem__(self, item):
-        from tables import Node,NoSuchNodeError
 
-        if isinstance(item,Node):
+        if isinstance(item,tables.Node):
             return self._get_item(item)
         else:
-            path,name = self._get_absolute_path(item)
-            try:
-                item = self.h5.getNode(path,name)
-            except NoSuchNodeError:
-                if not self.auto_create_grps:
-                    raise
-                item =  self.h5.createGroup(path,name,createparents=True)
-            return self._get_item(item)
+            return self._get_item(self._lookup(item))
+    def child(self, key):
+        """Return H5Node of group 'key' whatever it contains, stored tables are not loaded."""
+        node = self._lookup(key)
+        if not isinstance(node,tables.Group):
+            raise TypeError('%s is not a group' % node._v_pathname)
+        return self._resolve(node)[0]
     def __setitem__(self, key, value):
+        self.store(key, value)
+    def store(self, key, value, compression=None, complevel=None, chunkshape=None, extendable=False):
+        """Store 'value' under 'key'.
+
+        Parameters
+        ----------
+        key : string
+            name or path of the node
+        value : array-like
+            value to store, scalar is stored as one element array
+        compression : string
+            compression library ('blosc', 'zlib', 'lzo', 'bzip2'), defaults to 'compression'
+            of this node, False disables it. Compressed array is stored chunked (CArray)
+        complevel : int
+            compression level, defaults to 'complevel' of this node
+        chunkshape : tuple
+            shape of the chunk, chunked array (CArray) is stored if set
+        extendable : boolean
+            if True the array is stored as EArray, it can be extended along first axis
+
+        Scalars and arrays of other than numeric or string type are always stored
+        as Array.
+
+        """
+        from numpy import asarray
+        from tables import Filters,Atom
         path,name = self._get_absolute_path(key)
+        compression = self.compression if compression is None else compression
+        complevel = self.complevel if complevel is None else complevel
         if not isSequenceType(value):
             value = value,
-        self.h5.createArray(path,name,value, createparents=True)
+        array = asarray(value)
+        if (compression or chunkshape or extendable) and (extendable or array.size != 1) and \
+                array.ndim and array.dtype.kind in 'biufcS':
+            filters = Filters(complevel=complevel if compression else 0, complib=compression or 'zlib')
+            atom = Atom.from_dtype(array.dtype)
+            if extendable or not array.size:
+                node = self.h5.createEArray(path,name,atom,(0,)+array.shape[1:],filters=filters,
+                                            chunkshape=chunkshape,expectedrows=max(len(array),1),createparents=True)
+                node.append(array)
+            else:
+                node = self.h5.createCArray(path,name,atom,array.shape,filters=filters,
+                                            chunkshape=chunkshape,createparents=True)
+                node[:] = array
+        else:
+            self.h5.createArray(path,name,value, createparents=True)
+        self._invalidate(path.rstrip('/') + '/' + name)
+    def map(self, fnc, workers=None):
+        """Apply 'fnc' to every child of this node. Return list of (key, result) pairs.
+
+        Parameters
+        ----------
+        fnc : callable
+            function called with the child (Table, H5Node or value)
+        workers : int
+            if greater than 1 the children are distributed to a pool of 'workers'
+            processes, each of them opens the file read-only by path and loads only
+            the children assigned to it. Then 'fnc' and its results must be
+            picklable (e.g. module-level function). If this node holds the
+            file open for writing, the workers open it with file locking of
+            HDF5 1.10 and later disabled, so the file must not be modified
+            while mapping.
+
+        """
+        return self._map(fnc, None, workers)
+    def map_reduce(self, fnc, combine, initial=None, workers=None):
+        """Apply 'fnc' to every child of this node and reduce the results by 'combine'.
+
+        With 'workers' greater than 1, every process reduces its own children
+        and only the partial results are combined here, so 'combine' must be
+        associative. See map.
+        """
+        parts = self._map(fnc, combine, workers)
+        return reduce(combine, parts) if initial is None else reduce(combine, parts, initial)
+    def _map(self, fnc, combine, workers):
+        """return list of partial results of map/map_reduce"""
+        from multiprocessing import Pool
+        keys = self.keys()
+        if not workers or workers < 2:
+            return _map_group(self, keys, fnc, combine)
+        self.h5.flush()
+        step = max(1, -(-len(keys) // (4*workers)))
+        tasks = [ (self.h5.filename, self.group._v_pathname, keys[i:i+step], fnc, combine, self.chunksize)
+                  for i in xrange(0, len(keys), step) ]
+        pool = Pool(workers, _map_init, (self.h5.filename, self.h5.mode != 'r'))
+        try:
+            parts = pool.map(_map_task, tasks)
+        finally:
+            pool.terminate()
+        return [ r for part in parts for r in part ]
     def close(self):
         self.h5.close()
     def handle_exit(self, try_fnc, *arg,**kwarg):
@@ -139,7 +359,7 @@ class H5Node(object):
             self.close()
         exit()
     def _printNode(self, key, val, padding= '', last=False,maxdepth=None,maxcount=None):
-        from fabulous.color import highlight_blue,red,blue,green,cyan,yellow,bold
+        from colorize import red,green,cyan,yellow
         from tables import Array
 
         if isinstance(val,H5Node):
@@ -171,6 +391,7 @@ class H5Node(object):
             Limit count
 
         """
+        from colorize import bold,blue,boldblack
 
         if maxdepth is not None and maxdepth<0:
             print padding[:-1] + ' `'+bold(blue('...'))
@@ -198,6 +419,134 @@ class H5Node(object):
                     break
                 self._printNode(key,val,padding=padding+' |',last=not count,maxdepth=maxdepth-1,maxcount=maxcount)
 
+def _prefetch(iterable, size):
+    """Iterate over 'iterable' consumed by background thread at most 'size' items ahead.
+       Exception raised by 'iterable' is re-raised by the iterator, the thread is stopped
+       when the iterator is closed.
+    """
+    import sys
+    from threading import Thread,Event
+    from Queue import Queue,Full
+    queue = Queue(size)
+    stop = Event()
+    done = object()
+    def put(item):
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item,None)):
+                    return
+            put((done,None))
+        except BaseException:
+            put((done,sys.exc_info()))
+    thread = Thread(target=produce)
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            item,error = queue.get()
+            if item is done:
+                if error is not None:
+                    raise error[0], error[1], error[2]
+                return
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+def _argtop(keys, limit=None, descending=False):
+    """Return positions of 'keys' in sorted order, equal keys keep their order and NaNs are last.
+       Only first 'limit' positions are sorted, by partitioning in O(n + k log k).
+    """
+    n = len(keys)
+    if numpy.issubdtype(keys.dtype,numpy.inexact):
+        nan = numpy.isnan(keys)
+        if nan.any():
+            valid = numpy.flatnonzero(~nan)
+            top = valid[_argtop(keys[valid],limit,descending)]
+            return numpy.concatenate((top,numpy.flatnonzero(nan)))[:limit]
+    if limit is None or limit >= n:
+        if descending:
+            return (n-1 - numpy.argsort(keys[::-1], kind='mergesort'))[::-1][:limit]
+        return numpy.argsort(keys, kind='mergesort')[:limit]
+    if limit <= 0:
+        return numpy.argsort(keys[0:0])
+    kth = n-limit if descending else limit-1
+    v = keys[numpy.argpartition(keys,kth)[kth]]
+    head = numpy.flatnonzero(keys > v if descending else keys < v)
+    top = numpy.concatenate((head,numpy.flatnonzero(keys == v)[:limit-len(head)]))
+    top.sort()
+    return top[_argtop(keys[top],None,descending)]
+
+def _extendable(h5, fields, name, dtype):
+    """return EArray 'name' of table stored in 'h5' checking it can take rows of 'fields' and 'dtype'"""
+    from numpy import can_cast
+    from tables import EArray
+    if tuple(h5._node('fields').read()) != tuple(fields):
+        raise TypeError('Must have same fields')
+    node = h5._node(name)
+    if not isinstance(node,EArray):
+        raise TypeError('%s is not extendable, it must be stored by append_to' % node._v_pathname)
+    if not can_cast(dtype, node.atom.dtype, 'same_kind'):
+        raise TypeError('can not append %s to %s of %s' % (dtype, node._v_pathname, node.atom.dtype))
+    return node
+
+def _npy_dir(path, layout, fields, name=None):
+    """create directory 'path' with sidecar of table saved by save_npy, return path of file 'name' in it"""
+    from os import makedirs
+    from os.path import isdir,join
+    import json
+    if not isdir(path):
+        makedirs(path)
+    with open(join(path,'fields.json'),'w') as f:
+        json.dump({'layout':layout,'fields':list(fields)}, f)
+    return join(path,name) if name else path
+
+def _map_group(node, keys, fnc, combine):
+    """apply 'fnc' to children 'keys' of 'node', return list of (key,result) pairs or list of reduced result"""
+    if combine is None:
+        return [ (key, fnc(node[key])) for key in keys ]
+    if not keys:
+        return []
+    return [ reduce(combine, (fnc(node[key]) for key in keys)) ]
+
+def _map_init(filename, writable=False):
+    """Process pool initializer, closes HDF5 file 'filename' inherited from the parent process.
+    Forked worker would otherwise read through the file descriptor (and its offset)
+    shared with other workers. The parent flushed the file before forking, so closing
+    it here does not write anything. If the parent holds the file open for writing,
+    file locking of HDF5 1.10 and later is disabled in the worker, it would refuse
+    to open the file otherwise.
+    """
+    import os
+    from tables import file
+    if writable:
+        os.environ['HDF5_USE_FILE_LOCKING'] = 'FALSE'
+    registry = file._open_files
+    if isinstance(registry,dict):
+        handles = [ h for name,h in registry.items() if name == filename ]
+    else:
+        handles = registry.get_handlers_by_name(filename)
+    for handle in list(handles):
+        handle.close()
+
+def _map_task(args):
+    """process pool task of H5Node.map, opens the file read-only"""
+    filename, path, keys, fnc, combine, chunksize = args
+    root = H5Node(filename, auto_create_grps=False, chunksize=chunksize, mode='r')
+    try:
+        node = H5Node(filename, h5=root.h5, grp=root.h5.getNode(path), auto_create_grps=False, chunksize=chunksize)
+        return _map_group(node, keys, fnc, combine)
+    finally:
+        root.close()
+
 class Table(object):
     """Encapsulation of the numpy array, in order to conviently select/update data
     .
@@ -209,36 +558,180 @@ class Table(object):
         tuple of strings representing columns
     h5 : dataset.H5Node
         Initialize Table from HDF5 file
+    chunksize : int
+        If set together with 'h5' the data are not loaded into memory. The
+        table then walks the HDF5 array in blocks of 'chunksize' rows and only
+        rows matching the predicate are materialized.
+
+    Sorted indexes of columns can be built by 'create_index', the predicates on
+    indexed fields are then resolved by binary search.
+
+    Rows added by 'append' or 'extend' are stored in a buffer that grows
+    geometrically, '+' appends in place when the left table was made growable
+    by 'append', 'extend' or 'reserve'. 'freeze' returns compact copy.
+
+    If 'workers' is set, predicates are evaluated and matching rows gathered
+    by a pool of 'workers' threads, each processing a contiguous shard of rows
+    of at least 'shardsize' rows. Chunked tables are always scanned sequentially.
     """
-    def __init__(self, data=None, fields=None, h5=None):
-        from numpy import array,ndarray
+    shardsize = 1<<15
+    batchsize = 1<<16
+    def __init__(self, data=None, fields=None, h5=None, chunksize=None):
+        self.chunksize = chunksize
+        self.indexes = {}
+        self.workers = None
+        self._buffer,self._appending = None,False
         if h5 is not None:
             self.h5 = h5
-            self.data = h5['data'][...]
-            self.fields = tuple(h5['fields'])
+            if chunksize:
+                self.data = h5._node('data')
+            else:
+                self.data = h5['data'][...]
+                note(bytes_read=self.data.nbytes)
+            self.fields = tuple(h5._node('fields').read())
         elif data is not None and fields is not None:
-            self.data = data if isinstance(data,ndarray) else array(data)
+            self.data = data if isinstance(data,numpy.ndarray) else numpy.array(data)
             self.fields = tuple(fields)
         else:
             raise Exception('no data')
-        for f in self.fields:
-            setattr(self,f,Variable(f))
+    @property
+    def fields(self):
+        """tuple of strings representing columns"""
+        return self._fields
+    @fields.setter
+    def fields(self, fields):
+        self._fields = tuple(fields)
+        self._index = {}
+        for i,f in enumerate(self._fields):
+            self._index.setdefault(f,i)
+    def __getattr__(self, name):
+        """Fields are accessible as attributes, returning Variable to compose predicates.
+           Field shadowed by an attribute of the table is accessible by 'Variable(field)'.
+        """
+        if not name.startswith('_'):
+            index = self.__dict__.get('_index')
+            if index is not None and name in index:
+                return Variable(name)
+        raise AttributeError("'%s' object has no attribute '%s'" % (self.__class__.__name__, name))
+    def _derive(self,cls,fields):
+        """return new table of class 'cls' without data, field metadata are shared with this table if 'fields' are the same"""
+        t = cls.__new__(cls)
+        t.chunksize,t.indexes,t.workers = None,{},None
+        t._appending = False
+        if fields == self._fields:
+            t._fields,t._index = self._fields,self._index
+        else:
+            t.fields = fields
+        return t
     def __add__(self,other):
         """add two dataset objects. Must have same shape and fields."""
-        from numpy import vstack
         if not isinstance(other,Table):
             raise TypeError('Must be Dataset')
         if self.fields != other.fields:
             raise TypeError('Must have same fields')
+        if self._appending:
+            return self.append(other)
         if not len(self):
-            return Table(data=other.data,fields=self.fields)
+            result = Table(data=other._read(),fields=self.fields)
         elif not len(other):
             return self
         else:
-            return Table(data=vstack((self.data,other.data)),fields=self.fields)
+            result = Table(data=numpy.vstack((self._read(),other._read())),fields=self.fields)
+        for f in self.indexes:
+            result.create_index(f)
+        return result
     def __len__(self):
         """return the length of the dataset."""
         return self.data.shape[0]
+    def _growable(self):
+        """True if data are a view of the append buffer starting at its first row"""
+        return self._buffer is not None and self.data.base is self._buffer and \
+               numpy.byte_bounds(self.data)[0] == numpy.byte_bounds(self._buffer)[0]
+    def _reserve(self,rows,cols):
+        """make room for 'rows' x 'cols' in the append buffer, the capacity grows geometrically"""
+        self.load()
+        data = self.data if self.data.ndim == 2 else self.data.reshape(len(self.data),len(self.fields))
+        n,m = data.shape
+        cap = self._buffer.shape if self._growable() else data.shape
+        if self._growable() and rows <= cap[0] and cols <= cap[1]:
+            return
+        shape = ( max(rows,2*cap[0],16) if rows > cap[0] else cap[0],
+                  max(cols,2*cap[1]) if cols > cap[1] else cap[1] )
+        self._buffer = numpy.empty(shape, dtype=data.dtype)
+        self._buffer[:n,:m] = data
+        self.data = self._buffer[:n,:m]
+    def reserve(self,rows):
+        """Preallocate append buffer for 'rows' rows. Return self."""
+        self._reserve(rows,len(self.fields))
+        self._appending = True
+        return self
+    def append(self,rows):
+        """Append 'rows' in place. Return self.
+
+        Parameters
+        ----------
+        rows : array-like [n_rows, len(fields)] or Table
+            rows to append, table must have same fields
+
+        Storage grows geometrically, so building a table from N batches costs
+        amortized O(N) copies. Indexes are rebuilt when used next time.
+        """
+        if isinstance(rows,Table):
+            if rows.fields != self.fields:
+                raise TypeError('Must have same fields')
+            rows = rows._read()
+        rows = numpy.asarray(rows)
+        if rows.ndim == 1:
+            rows = rows.reshape(1,-1)
+        if rows.shape[1] != len(self.fields):
+            raise ValueError('rows must have %d fields' % len(self.fields))
+        n,k = len(self),rows.shape[0]
+        self._reserve(n+k,len(self.fields))
+        self._buffer[n:n+k,:len(self.fields)] = rows
+        self.data = self._buffer[:n+k,:len(self.fields)]
+        self._appending = True
+        for f in self.indexes:
+            self.indexes[f] = None
+        return self
+    def extend(self,batches):
+        """Append every batch of iterable 'batches' (see append). Return self."""
+        for rows in batches:
+            self.append(rows)
+        return self
+    def freeze(self):
+        """Return compact copy of the table without spare capacity of the append buffer."""
+        result = self._copy()
+        for f in self.indexes:
+            result.create_index(f)
+        return result
+    def _copy(self):
+        """return new table holding compact copy of the data"""
+        return Table(data=numpy.array(self._read(),order='C'),fields=self.fields)
+    def _is_lazy(self):
+        """True if data are streamed from HDF5 file rather than held in memory."""
+        return not isinstance(self.data,numpy.ndarray)
+    def _read(self):
+        """return the data as in-memory array, reading them from file if necessary"""
+        if not self._is_lazy():
+            return self.data
+        data = self.data.read()
+        note(bytes_read=data.nbytes)
+        return data
+    def _blocks(self):
+        """Iterate over (offset, block) pairs, each block having at most 'chunksize' rows."""
+        n = len(self)
+        step = self.chunksize or n or 1
+        lazy = self._is_lazy()
+        for start in xrange(0,n,step):
+            block = self.data[start:start+step]
+            if lazy:
+                note(bytes_read=block.nbytes)
+            yield start, block
+    def load(self):
+        """Read the content of the chunked table into memory. Return self."""
+        if self._is_lazy():
+            self.data = self._read()
+        return self
     def _check_fields(self,fields):
         err = [f for f in fields if f not in self.fields]
         if len(err):
@@ -264,8 +757,9 @@ class Table(object):
         return self.select(pred,fields=fields,retdset=retdset)
     def __delitem__(self, key):
         pred,fields,retdset = self._parse_key(key)
-        d = self.select(pred,fields=fields,retdset=retdset)
-        self.data,self.fields = d.data,d.fields
+        d = self.select(pred,fields=fields,retdset=True)
+        self._replace(d)
+        self._reindex()
     def __setitem__(self, key, value):
         if not len(self):
             return
@@ -275,44 +769,289 @@ class Table(object):
         return item in self.fields
     def __iter__(self):
         return ( self[i] for i in xrange(len(self)) )
+    def iterbatches(self, size=None):
+        """Iterate over tables of consecutive 'size' rows (defaults to 'chunksize' or 'batchsize').
+           Batches of in-memory table are views of its data, chunked table is read one batch at a time.
+        """
+        size = size or self.chunksize or self.batchsize
+        for start in xrange(0,len(self),size):
+            yield self.select(slice(start,start+size),retdset=True)
+    def iterrows(self, named=False, size=None):
+        """Iterate over rows as tuples of Python values, or namedtuples with fields as attributes if 'named'.
+           Rows are converted batch by batch (see iterbatches).
+        """
+        from itertools import izip,imap
+        from collections import namedtuple
+        row = namedtuple('Row', self.fields, rename=True)._make if named else None
+        for batch in self.iterbatches(size):
+            rows = izip(*[ batch._column(f).tolist() for f in batch.fields ])
+            for r in (imap(row,rows) if named else rows):
+                yield r
     def keys(self):
         return self.fields
+    @property
+    def dtype(self):
+        return self.data.dtype
     def __str__(self):
-        return 'Table(%s,__len__=%d,__dtype__=%s)'%( ','.join(self.keys()), len(self),self.data.dtype)
+        return 'Table(%s,__len__=%d,__dtype__=%s)'%( ','.join(self.keys()), len(self),self.dtype)
     def __repr__(self):
-        return '<dataset.Table(%s,__len__=%d,__dtype__=%s)>'%( ','.join(self.keys()), len(self),self.data.dtype)
+        return '<dataset.Table(%s,__len__=%d,__dtype__=%s)>'%( ','.join(self.keys()), len(self),self.dtype)
     def _getfield(self,x,f):
         """return vector containing the field"""
-        return x[...,self.fields.index(f)]
-    def _get_indexing(self,predicate,fields):
-        from numpy import array,newaxis,ndarray
-        # rows
+        return x[...,self._index[f]]
+    def _frame(self):
+        """return in-memory storage predicates are evaluated against"""
+        return self.data
+    def _wrap(self,result,fields):
+        """return new table of the same kind holding 'result', it shares field metadata with this table"""
+        t = self._derive(Table,fields)
+        t._buffer = None
+        t.data = result
+        return t
+    def _matrix(self,result):
+        """return 'result' as submatrix"""
+        return result
+    def _replace(self,other):
+        """take over content of table 'other', the append buffer is dropped"""
+        self.data,self._buffer = other.data,None
+        self._fields,self._index = other._fields,other._index
+    def _from_columns(self,fields,arrays):
+        """return new table of the same kind made of 1-D 'arrays'"""
+        return Table(data=numpy.column_stack(arrays) if arrays else numpy.empty((0,0)),fields=fields)
+    def _column(self,f):
+        """return vector containing the field, chunked table is read block by block"""
+        if not self._is_lazy():
+            return self._getfield(self.data,f)
+        blocks = [ self._getfield(block,f) for start,block in self._blocks() ]
+        return numpy.concatenate(blocks) if blocks else self._getfield(self.data[0:0],f)
+    def create_index(self,field):
+        """Build sorted index of column 'field'.
+
+        Index keeps sorted permutation of the column. Terms Lt, Le, Gt, Ge, Eq and
+        In on the field are then resolved by binary search in O(log n + k). In
+        conjunction the most selective indexed term is used and remaining terms are
+        evaluated only on rows it matched. Index is rebuilt when the table is
+        modified by its methods, direct writes to 'data' are not tracked.
+        """
+        self._check_fields((field,))
+        column = self._column(field)
+        perm = numpy.argsort(column, kind='mergesort')
+        keys = column[perm]
+        # NaNs are sorted to the end and never match
+        valid = len(keys) - (numpy.isnan(keys).sum() if numpy.issubdtype(keys.dtype,numpy.inexact) else 0)
+        self.indexes[field] = perm,keys,valid
+    def drop_index(self,field):
+        """Remove index of column 'field'."""
+        self.indexes.pop(field,None)
+    def _reindex(self,fields=None):
+        """rebuild indexes of 'fields' (all if None), indexes of removed fields are dropped"""
+        for f in [f for f in (self.indexes.keys() if fields is None else fields) if f in self.indexes]:
+            if f in self.fields:
+                self.create_index(f)
+            else:
+                del self.indexes[f]
+    def _plan(self,predicate):
+        """Resolve 'predicate' by an index. Return sorted row numbers or None if no index applies.
+           Index is not used if some term depends on position of rows (e.g. has array operand),
+           the remaining terms are evaluated only on rows matched by the index.
+        """
+        if isinstance(predicate,Conj):
+            terms = predicate.preds
+        elif isinstance(predicate,Term):
+            terms = predicate,
+        else:
+            return None
+        if not all(_rowwise(t) for t in terms):
+            return None
+        best = None
+        for i,t in enumerate(terms):
+            if not isinstance(t,Term) or t.field not in self.indexes:
+                continue
+            if self.indexes[t.field] is None:
+                self.create_index(t.field)
+            perm,keys,valid = self.indexes[t.field]
+            ranges = t._ranges(keys,valid)
+            if ranges is None:
+                continue
+            size = sum(hi-lo for lo,hi in ranges)
+            if best is None or size < best[0]:
+                best = size,i,ranges,perm
+        if best is None:
+            return None
+        size,i,ranges,perm = best
+        rows = numpy.concatenate([perm[lo:hi] for lo,hi in ranges] or [perm[0:0]])
+        rows.sort()
+        rest = terms[:i] + terms[i+1:]
+        if rest and len(rows):
+            rest = rest[0] if len(rest) == 1 else Conj(*rest)
+            rows = rows[self._get_rows(rest, self._frame()[rows])]
+        return rows
+    def _get_rows(self,predicate,data=None,workers=None):
+        """return row index for 'predicate' evaluated against 'data' (whole table if None)"""
+        if isinstance(predicate,Predicate):
+            rows = self._plan(predicate) if self.indexes and data is None else None
+            if rows is not None:
+                return rows
+            predicate = predicate.compile()
         if callable(predicate):
-            pred = predicate (self.data, self._getfield)
+            if data is None:
+                return self._evaluate(predicate, self.workers if workers is None else workers)
+            return predicate (data, self._getfield)
         elif isinstance(predicate,int):
-            pred =  slice(predicate,predicate+1)
+            return slice(predicate,predicate+1)
         elif isinstance(predicate, slice) or predicate is Ellipsis:
-            pred =  predicate
+            return predicate
         else:
-            pred = Ellipsis
-        # columns
-        if isinstance(fields,tuple) and len(fields) == 1 :
-            if isinstance(fields[0],slice):
-                fldidx = slice(self.fields.index(fields[0].start),self.fields.index(fields[0].stop))
+            return Ellipsis
+    def _shards(self,workers):
+        """split rows into at most 'workers' contiguous (start,stop) ranges of at least 'shardsize' rows"""
+        n = len(self)
+        step = max(-(-n // (workers or 1)), self.shardsize)
+        return [ (start,min(start+step,n)) for start in xrange(0,n,step) ]
+    @instrument('Table.evaluate')
+    def _evaluate(self,predicate,workers):
+        """evaluate callable 'predicate' on the whole table, in parallel shards if 'workers' > 1.
+           Only compiled predicates evaluated row by row ('blockable') are sharded, plain
+           callables and predicates with array operands are evaluated by single call.
+        """
+        frame = self._frame()
+        shards = self._shards(workers)
+        if len(shards) < 2 or not (isinstance(predicate,CompiledPredicate) and predicate.blockable):
+            return predicate (frame, self._getfield)
+        def evaluate(shard):
+            return predicate (frame[shard[0]:shard[1]], self._getfield)
+        return numpy.concatenate(_thread_pool(workers).map(evaluate, shards))
+    @instrument('Table.gather')
+    def _gather(self,rows,fldidx,workers):
+        """apply (rows,columns) index to the table, boolean mask is gathered in parallel shards"""
+        frame = self._frame()
+        shards = self._shards(workers)
+        if len(shards) < 2 or not isinstance(rows,numpy.ndarray) or rows.dtype != bool:
+            return self._take(frame,(rows,fldidx))
+        def gather(shard):
+            start,stop = shard
+            return self._take(frame[start:stop],(rows[start:stop],fldidx))
+        return self._concat(_thread_pool(workers).map(gather, shards))
+    def _concat(self,parts):
+        """concatenate row blocks 'parts'"""
+        return numpy.concatenate(parts)
+    def _get_columns(self,fields):
+        """return column index and names for 'fields'"""
+        index = self._index
+        try:
+            if isinstance(fields,tuple) and len(fields) == 1 :
+                if isinstance(fields[0],slice):
+                    fldidx = slice(index[fields[0].start],index[fields[0].stop])
+                else:
+                    fldidx = index[fields[0]]
+                    fldidx = slice(fldidx,fldidx+1)
+                fields = self.fields[fldidx]
+            elif fields:
+                fldidx = numpy.array([ index[f] for f in fields ])
             else:
-                fldidx = self.fields.index(fields[0])
-                fldidx = slice(fldidx,fldidx+1)
-            fields = self.fields[fldidx]
-        elif fields:
-            fldidx = array([ f in fields for f in self.fields ])
-        else:
-            fields = self.fields
-            fldidx = Ellipsis
-
+                fields = self.fields
+                fldidx = Ellipsis
+        except KeyError, e:
+            raise ValueError('some fields not in this dataset (%s)' % [e.args[0]])
+        return fldidx,fields
+    def _get_indexing(self,predicate,fields,data=None):
+        fldidx,fields = self._get_columns(fields)
+        pred = self._get_rows(predicate, data)
         return (pred,fldidx),fields
+    def _match(self,predicate):
+        """return row index of 'predicate' over the whole table, chunked table is evaluated block by block"""
+        if not self._is_lazy():
+            return self._get_rows(predicate)
+        rows = self._kernel(predicate)
+        if not callable(rows):
+            return rows
+        return numpy.concatenate([ rows(block,self._getfield) for start,block in self._blocks() ] or [numpy.zeros(0,bool)])
+    def _row_ids(self,rows):
+        """return row index 'rows' as vector of row numbers"""
+        return numpy.arange(len(self))[rows]
+    def _sort_rows(self,rows,order,limit=None,descending=False):
+        """return row numbers of 'rows' ordered by field 'order', only first 'limit' if set"""
+        rows = self._row_ids(rows)
+        return rows[_argtop(self._column(order)[rows],limit,descending)]
+    def _take(self,data,idx):
+        """apply (rows,columns) index 'idx' to 'data'"""
+        if idx[0] is Ellipsis:
+            idx = slice(None),idx[1]
+        if isinstance(idx[0],numpy.ndarray) and isinstance(idx[1],numpy.ndarray):
+            return data[idx[0],...][...,idx[1]]
+        else:
+            return data[idx]
+    def _assign(self,data,idx,value):
+        """set 'value' to 'data' at index 'idx'"""
+        if idx[0] is Ellipsis:
+            idx = slice(None),idx[1]
+        if isinstance(idx[0],numpy.ndarray) and isinstance(idx[1],numpy.ndarray):
+            idx = numpy.ix_(numpy.flatnonzero(idx[0]) if idx[0].dtype == bool else idx[0], idx[1])
+        if callable(value):
+            data[idx] = value(data[idx])
+        else:
+            data[idx] = value
+    def _kernel(self,predicate):
+        """return callable row filter for 'predicate' or its row index if not callable.
+           Predicate of chunked table that can not be evaluated block by block (e.g. has
+           array operand) is evaluated at once, returning boolean mask of all rows.
+        """
+        if isinstance(predicate,Predicate):
+            kernel = predicate.compile()
+            if self._is_lazy() and not kernel.blockable:
+                return self._evaluate_columns(kernel)
+            return kernel
+        return predicate if callable(predicate) else self._get_rows(predicate, None)
+    def _evaluate_columns(self,kernel):
+        """evaluate 'kernel' on the whole chunked table, only the fields it references are read"""
+        refs = kernel.refs()
+        if refs is None:
+            return kernel(self._read(), self._getfield)
+        fields = tuple(f for f in self.fields if f in refs)
+        blocks = [ [ self._getfield(block,f) for f in fields ] for start,block in self._blocks() ]
+        columns = [ numpy.concatenate([ b[i] for b in blocks ]) if blocks else self._getfield(self.data[0:0],f)
+                    for i,f in enumerate(fields) ]
+        return kernel(Columns(fields,columns), lambda x,f: x[f])
+    def _block_rows(self,predicate,start,block):
+        """return row index of a single block starting at row 'start', 'predicate' is callable,
+           boolean mask of all rows or Ellipsis"""
+        if callable(predicate):
+            return predicate(block, self._getfield)
+        if isinstance(predicate,numpy.ndarray):
+            return predicate[start:start+block.shape[0]]
+        return slice(None)
+    @instrument('Table.scan')
+    def _scan(self,predicate,fldidx,limit=None,key=None,descending=False):
+        """Select rows of the chunked table block by block. Only the matching rows are kept in memory.
+           If 'limit' is set, the scan stops after first 'limit' rows, or only running top 'limit'
+           rows ordered by column 'key' of the result are kept when 'key' is set.
+        """
+        rows = self._kernel(predicate)
+        if isinstance(rows,slice):
+            start,stop,step = rows.indices(len(self))
+            if limit is not None and key is None and step > 0:
+                rows = slice(start,min(stop,start+max(limit,0)*step),step)
+            return self._take(self.data[rows], (slice(None),fldidx))
+        parts,best,count = [],None,0
+        for start,block in self._blocks():
+            part = self._take(block, (self._block_rows(rows,start,block),fldidx))
+            if limit is not None and key is not None:
+                best = part if best is None else self._concat((best,part))
+                best = best[_argtop(best[...,key],limit,descending)]
+                continue
+            parts.append(part)
+            count += len(part)
+            if limit is not None and count >= limit:
+                break
+        if best is not None:
+            return best
+        if not parts:
+            return self._take(self.data[0:0], (slice(None),fldidx))
+        return self._concat(parts)
     def squeeze(self):
-        return self.data.squeeze()
-    def select(self, predicate, order=None, retdset=None, fields=None, **kwargs):
+        return self._read().squeeze()
+    @instrument('Table.select')
+    def select(self, predicate, order=None, retdset=None, fields=None, workers=None, limit=None, descending=False, **kwargs):
         """Select submatrix based on predicate and fields.
 
         Example:
@@ -330,56 +1069,195 @@ class Table(object):
             If true result is wrapped in new dataset.Table instance.
         fields : tuple
             Fields to retain in result.
+        workers : int
+            Number of threads evaluating the predicate and gathering the rows,
+            defaults to 'workers' attribute of the table.
+        limit : int
+            Return only first 'limit' rows. With 'order' only the top rows are
+            sorted (partial sort in O(n + k log k)), chunked table keeps running
+            top rows of the blocks, without 'order' its scan stops early.
+        descending : boolean
+            Order from the largest value, NaNs are last in both directions.
 
 
         Returns
         -------
             a submatrix or a new Table object based on predicate
         """
-        from numpy import argsort,ndarray
-
-        idx,fields = self._get_indexing(predicate,fields)
-        if isinstance(idx[0],ndarray) and isinstance(idx[1],ndarray):
-            result = self.data[idx[0],...][...,idx[1]]
+        fldidx,fields = self._get_columns(fields)
+        key = list(fields).index(order) if order is not None and order in fields else None
+        if self._is_lazy():
+            result = self._scan(predicate,fldidx,limit,key,descending)
+            if key is not None:
+                result = result[_argtop(result[...,key],limit,descending)]
+            elif limit is not None:
+                result = result[:limit]
         else:
-            result = self.data[idx]
+            workers = self.workers if workers is None else workers
+            rows = self._get_rows(predicate,workers=workers)
+            if key is not None:
+                rows = self._sort_rows(rows,order,limit,descending)
+            elif limit is not None:
+                rows = slice(0,limit) if rows is Ellipsis else self._row_ids(rows)[:limit]
+            result = self._gather(rows,fldidx,workers)
+            note(temp_bytes=rows.nbytes if isinstance(rows,numpy.ndarray) else 0)
+        note(rows_scanned=len(self), rows_returned=len(result))
 
-        if order is not None and order in fields:
-            result = result[argsort( result[...,self.fields.index(order)] ),...]
         if retdset:
-            return Table(data=result,fields=fields)
+            return self._wrap(result,fields)
         else:
-            return result
+            return self._matrix(result)
+    def groupby(self, field, predicate=None):
+        """Group rows matched by 'predicate' by value of 'field'.
+
+        Example:
+            r = data.groupby('size', data.time < t).agg(count=True, sum='bytes', max=('time','bytes'))
+            # new Table with fields size, count, bytes_sum, time_max and bytes_max
+
+        Returns
+        -------
+            dataset.GroupBy instance
+        """
+        return GroupBy(self, field, predicate)
+    def query(self):
+        """Start deferred chain of operations, evaluated at once by 'collect'.
+
+        Example:
+            r = data.query().where(data.size >= 10).set('size', 0, data.time < t).order('time').project('time','size').collect()
+            print data.query().where(data.size >= 10).order('time').explain()
+
+        Returns
+        -------
+            dataset.Query instance
+        """
+        return Query(self)
+    def join(self, other, on, how='inner', fill=None, suffix='_r'):
+        """Join rows of table 'other' having equal value of field 'on'.
+
+        Keys of 'other' are sorted (or its index of 'on' is used) and matched
+        by binary search, all matching pairs are then expanded at once.
+
+        Parameters
+        ----------
+        other : dataset.Table
+            the table to join
+        on : string
+            key field present in both tables
+        how : string
+            'inner' keeps only matched rows, 'left' keeps all rows of this table
+        fill : scalar
+            value of fields of 'other' in unmatched rows of left join, defaults to NaN
+        suffix : string
+            appended to fields of 'other' whose name clashes with this table
+
+        Returns
+        -------
+            a new Table with fields of this table followed by fields of 'other' except 'on'
+        """
+        if how not in ('inner','left'):
+            raise ValueError('unknown join (%s)' % how)
+        self._check_fields((on,))
+        other._check_fields((on,))
+        fill = numpy.nan if fill is None else fill
+        left = self._column(on)
+        if other.indexes.get(on) is not None:
+            perm,keys,valid = other.indexes[on]
+        else:
+            right = other._column(on)
+            perm = numpy.argsort(right, kind='mergesort')
+            keys = right[perm]
+        lo = keys.searchsorted(left,'left')
+        counts = keys.searchsorted(left,'right') - lo
+        counts[left != left] = 0
+        emit = counts if how == 'inner' else counts.clip(1,None)
+        total = emit.sum()
+        lrows = numpy.repeat(numpy.arange(len(left)),emit)
+        missing = numpy.repeat(counts == 0,emit)
+        if len(perm):
+            offsets = numpy.arange(total) - numpy.repeat(numpy.cumsum(emit) - emit,emit)
+            rrows = perm[(numpy.repeat(lo,emit) + offsets).clip(0,len(perm)-1)]
+        fields = list(self.fields)
+        arrays = [ self._column(f)[lrows] for f in self.fields ]
+        for f in other.fields:
+            if f == on:
+                continue
+            column = other._column(f)
+            if not len(perm):
+                values = numpy.full(total, fill, dtype=numpy.result_type(column.dtype,fill))
+            else:
+                values = column[rrows]
+                if missing.any():
+                    values = values.astype(numpy.result_type(values.dtype,fill))
+                    values[missing] = fill
+            fields.append(f + suffix if f in self.fields else f)
+            arrays.append(values)
+        return self._from_columns(fields,arrays)
     def add_field(self, field, default):
         """Add new column called 'field' and set its value to 'default'. It can be vector or scalar (it will be broadcast)."""
-        from numpy import hstack,ndarray
-        buff = ndarray( shape=(self.data.shape[0],1),dtype=self.data.dtype)
-        buff[:] = default
-        self.data,self.fields = hstack((self.data,buff)),self.fields+(field,)
+        n,m = len(self),len(self.fields)
+        self._reserve(n,m+1)
+        self._buffer[:n,m:m+1] = default
+        self.data,self.fields = self._buffer[:n,:m+1],self.fields+(field,)
     def retain_fields(self, fields):
         """Keep column specified in 'fields', others are discarded."""
         if any(f not in self.fields for f in fields):
             raise ValueError('some fields not in this dataset')
-        self.data = self.data[...,tuple(self.fields.index(f) for f in fields)]
+        self.load()
+        self.data = self.data[...,tuple(self._index[f] for f in fields)]
         self.fields = fields
+        for f in [f for f in self.indexes if f not in fields]:
+            del self.indexes[f]
+    @instrument('Table.set_fields')
     def set_fields(self, predicate, fields, value):
         """Set column specified by 'field', and rows matched by 'predicate' set its value to 'value'.
            It can be vector or scalar (it will be broadcast).
+           Chunked table is updated in place block by block.
+           Return the number of rows matched by 'predicate'.
         """
-        from numpy import ndarray
+
+        if self._is_lazy():
+            count = self._update_blocks(predicate, fields, value)
+            self._reindex(self._get_columns(fields)[1])
+            note(rows_scanned=len(self), rows_updated=count)
+            return count
 
         idx,fields = self._get_indexing(predicate,fields)
         # evaluate
-        if callable(value):
-            self.data[idx] = value(self.data[idx])
-        else:
-            self.data[idx] = value
+        self._assign(self._frame(), idx, value)
+        self._reindex(fields)
+        note(rows_scanned=len(self), temp_bytes=idx[0].nbytes if isinstance(idx[0],numpy.ndarray) else 0)
 
         # return updated row count
+        return self._count(idx[0],len(self))
+    def _count(self, rows, n):
+        """return number of rows selected by row index 'rows' out of 'n' rows"""
+        if isinstance(rows,numpy.ndarray):
+            return int(rows.sum()) if rows.dtype == bool else rows.shape[0]
+        if isinstance(rows,slice):
+            return len(xrange(*rows.indices(n)))
+        return n
+    def _update_blocks(self, predicate, fields, value):
+        """Update chunked table by reading, modifying and writing back one block at a time."""
+        fldidx,fields = self._get_columns(fields)
+        rows = self._kernel(predicate)
+        if isinstance(rows,slice):
+            block = self.data[rows]
+            self._assign(block, (slice(None),fldidx), value)
+            self.data[rows] = block
+            return block.shape[0]
+        count = 0
+        for start,block in self._blocks():
+            idx = (self._block_rows(rows,start,block),fldidx)
+            matched = self._count(idx[0],block.shape[0])
+            if not matched:
+                continue
+            self._assign(block, idx, value)
+            self.data[start:start+block.shape[0]] = block
+            count += matched
+        return count
 
-        return idx.shape[0] if isinstance(idx,ndarray) else idx[0].shape[0] if isinstance(idx[0],ndarray) else -1
-
-    def save(self,h5):
+    @instrument('Table.save')
+    def save(self,h5,compression=None,complevel=None,chunkshape=None):
         """Save the content in 'h5' group.
 
 
@@ -387,13 +1265,542 @@ class Table(object):
         ----------
         h5 : H5Node
             a node to store the content
+        compression : string
+            compression library ('blosc', 'zlib', 'lzo', 'bzip2'), data are then stored
+            chunked and compressed. Defaults to the setting of 'h5' (see H5Node.store)
+        complevel : int
+            compression level
+        chunkshape : tuple
+            shape of the chunk of data
+
+        """
+        data = self._read()
+        h5.store('data', data, compression=compression, complevel=complevel, chunkshape=chunkshape)
+        note(bytes_written=data.nbytes)
+        h5.store('fields', self.fields, compression=False)
+
+    @instrument('Table.append_to')
+    def append_to(self,h5,key=None,compression=None,complevel=None,chunkshape=None):
+        """Append the rows to the table stored in 'h5' group (or its child group 'key'),
+        the table is created if it does not exist.
+
+        Example:
+            batch.append_to(h5, 'archive')
+
+        Data are stored as extendable array (EArray) and the rows are appended in
+        place, so the cost is proportional to the size of this table. Stored table
+        must have the same fields and have been created by 'append_to'. Arguments
+        'compression', 'complevel' and 'chunkshape' apply when the table is created
+        (see save). Return number of stored rows.
+        """
+        if key is not None:
+            h5 = h5.child(key)
+        data = self._read()
+        if 'data' not in h5:
+            h5.store('data', data, compression=compression, complevel=complevel, chunkshape=chunkshape, extendable=True)
+            h5.store('fields', self.fields, compression=False)
+        else:
+            _extendable(h5, self.fields, 'data', data.dtype).append(data)
+        note(bytes_written=data.nbytes)
+        return h5._node('data').nrows
+
+    def save_npy(self,path):
+        """Save the content in directory 'path' as raw NumPy file 'data.npy' and
+           sidecar 'fields.json', it can be opened by 'Table.open_mmap'. Chunked
+           table is copied block by block.
+        """
+        from numpy.lib.format import open_memmap
+        out = open_memmap(_npy_dir(path,'rows',self.fields,'data.npy'), mode='w+',
+                          dtype=self.dtype, shape=(len(self),len(self.fields)))
+        for start,block in self._blocks():
+            out[start:start+block.shape[0]] = block
+        out.flush()
+
+    @classmethod
+    def from_iter(cls, records, fields, batchsize=None, dtype=None):
+        """Build table from iterable of 'records' (sequences of values of 'fields').
+
+        Records are converted to arrays of 'batchsize' rows (see iterable.iblocks) and
+        appended (see extend), so the stream is never held as list. Type of the data is
+        'dtype' or type of the first batch. Result keeps spare capacity, see freeze.
+        """
+        from numpy import empty
+        from iterable import iblocks
+        fields = tuple(fields)
+        blocks = ( b.reshape(len(b),len(fields)) for b in iblocks(records, batchsize or cls.batchsize, dtype) )
+        first = next(blocks, None)
+        if first is None:
+            first = empty((0,len(fields)), dtype=dtype or float)
+        return cls(data=first, fields=fields).extend(blocks)
+
+    @staticmethod
+    def open_mmap(path, mode='r'):
+        """Open table saved by 'save_npy' in directory 'path'.
 
+        The data are memory-mapped, opening does not read them and selected
+        slices are views of the page cache, shared by all processes opening the
+        same table. Use mode='r+' to write changes back, 'c' for copy-on-write.
         """
-        h5['data'] =  self.data
-        h5['fields'] =  self.fields
+        from numpy import load
+        from os.path import join
+        import json
+        with open(join(path,'fields.json')) as f:
+            meta = json.load(f)
+        fields = tuple(str(f) for f in meta['fields'])
+        if meta['layout'] == 'columns':
+            return ColumnTable(columns=[ load(join(path,'%d.npy' % i), mmap_mode=mode) for i in xrange(len(fields)) ], fields=fields)
+        return Table(data=load(join(path,'data.npy'), mmap_mode=mode), fields=fields)
+
+class Columns(object):
+    """Struct of arrays, every field is stored as contiguous 1-D array.
+
+    Indexing by field name returns the column. Any other index (slice, mask,
+    row numbers) is applied to all columns and new Columns is returned.
+
+    Parameters
+    ----------
+    fields : tuple
+        tuple of strings representing columns
+    arrays : sequence
+        1-D arrays of the same length, one per field
+
+    """
+    def __init__(self, fields, arrays):
+        self.fields = tuple(fields)
+        self.arrays = tuple(arrays)
+        self._map = dict(zip(self.fields,self.arrays))
+    @property
+    def shape(self):
+        return (len(self.arrays[0]) if self.arrays else 0, len(self.arrays))
+    def __len__(self):
+        return self.shape[0]
+    def __getitem__(self, key):
+        if isinstance(key,basestring):
+            return self._map[key]
+        return Columns(self.fields, [a[key] for a in self.arrays])
+    def project(self, fields):
+        """return columns 'fields' without copying them"""
+        return Columns(fields, [self._map[f] for f in fields])
+
+class ColumnTable(Table):
+    """Table storing every field as separate contiguous 1-D array with its own dtype.
+
+    Access to the column does not stride over the other fields, adding and
+    removing columns does not copy the data. 'data' attribute is assembled
+    on access and changes to it are not propagated back.
+
+    Parameters
+    ----------
+    data : array-like [n_rows, len(fields)]
+        the data representing this table, split into columns
+    fields : tuple
+        tuple of strings representing columns
+    h5 : dataset.H5Node
+        Initialize ColumnTable from HDF5 file (saved either by Table or ColumnTable)
+    columns : sequence
+        1-D arrays, one per field
+    """
+    def __init__(self, data=None, fields=None, h5=None, columns=None):
+        self.chunksize = None
+        self.indexes = {}
+        self.workers = None
+        self._buffers,self._appending = None,False
+        if h5 is not None:
+            self.h5 = h5
+            fields = tuple(h5._node('fields').read())
+            if 'columns' in h5:
+                columns = [ h5._node('columns/%s' % f).read() for f in fields ]
+                note(bytes_read=sum(c.nbytes for c in columns))
+            else:
+                data = h5._node('data').read()
+                note(bytes_read=data.nbytes)
+        if fields is None or (data is None and columns is None):
+            raise Exception('no data')
+        self.fields = tuple(fields)
+        if columns is None:
+            data = numpy.asarray(data)
+            columns = [ numpy.ascontiguousarray(data[...,i]) for i in xrange(len(self.fields)) ]
+        self.columns = Columns(self.fields, [numpy.asarray(c) for c in columns])
+    @property
+    def data(self):
+        return numpy.column_stack(self.columns.arrays) if self.fields else numpy.empty((0,0))
+    @property
+    def dtype(self):
+        return numpy.dtype([ (f,a.dtype) for f,a in zip(self.fields,self.columns.arrays) ])
+    def __add__(self,other):
+        """add two dataset objects. Must have same fields."""
+        if not isinstance(other,Table):
+            raise TypeError('Must be Dataset')
+        if self.fields != other.fields:
+            raise TypeError('Must have same fields')
+        if self._appending:
+            return self.append(other)
+        if not len(other):
+            return self
+        result = ColumnTable(columns=[ numpy.concatenate((self._column(f),other._column(f))) for f in self.fields ],fields=self.fields)
+        for f in self.indexes:
+            result.create_index(f)
+        return result
+    def __len__(self):
+        return len(self.columns)
+    def _growable(self):
+        return self._buffers is not None and len(self._buffers) == len(self.columns.arrays) and \
+               all(a.base is b and numpy.byte_bounds(a)[0] == numpy.byte_bounds(b)[0]
+                   for a,b in zip(self.columns.arrays,self._buffers))
+    def _reserve(self,rows,cols=None):
+        buffers = self._buffers if self._growable() else self.columns.arrays
+        n = len(self)
+        resized = []
+        for a,b in zip(self.columns.arrays,buffers):
+            if not self._growable() or rows > len(b):
+                b = numpy.empty(max(rows,2*len(b),16), dtype=a.dtype)
+                b[:n] = a
+            resized.append(b)
+        self._buffers = resized
+        self.columns = Columns(self.fields, [ b[:n] for b in resized ])
+    def append(self,rows):
+        if isinstance(rows,Table):
+            if rows.fields != self.fields:
+                raise TypeError('Must have same fields')
+            arrays = [ rows._column(f) for f in self.fields ]
+        else:
+            rows = numpy.asarray(rows)
+            if rows.ndim == 1:
+                rows = rows.reshape(1,-1)
+            if rows.shape[1] != len(self.fields):
+                raise ValueError('rows must have %d fields' % len(self.fields))
+            arrays = [ rows[...,i] for i in xrange(len(self.fields)) ]
+        n,k = len(self),len(arrays[0]) if arrays else 0
+        self._reserve(n+k)
+        for a,b in zip(arrays,self._buffers):
+            b[n:n+k] = a
+        self.columns = Columns(self.fields, [ b[:n+k] for b in self._buffers ])
+        self._appending = True
+        for f in self.indexes:
+            self.indexes[f] = None
+        return self
+    def _copy(self):
+        return ColumnTable(columns=[ a.copy() for a in self.columns.arrays ],fields=self.fields)
+    def _is_lazy(self):
+        return False
+    def load(self):
+        return self
+    def _getfield(self,x,f):
+        return x[f]
+    def _column(self,f):
+        return self.columns[f]
+    def _frame(self):
+        return self.columns
+    def _wrap(self,result,fields):
+        t = self._derive(ColumnTable,fields)
+        t._buffers = None
+        t.columns = result if result.fields == t.fields else Columns(t.fields,result.arrays)
+        return t
+    def _matrix(self,result):
+        return numpy.column_stack(result.arrays)
+    def _replace(self,other):
+        self.columns,self._buffers = other.columns,None
+        self._fields,self._index = other._fields,other._index
+    def _from_columns(self,fields,arrays):
+        return ColumnTable(columns=arrays,fields=fields)
+    def _concat(self,parts):
+        return Columns(parts[0].fields, [ numpy.concatenate([ p.arrays[i] for p in parts ]) for i in xrange(len(parts[0].arrays)) ])
+    def _get_columns(self,fields):
+        fldidx,fields = super(ColumnTable,self)._get_columns(fields)
+        return fields,fields
+    def _take(self,data,idx):
+        rows,fields = idx
+        return Columns(fields, [ data[f][rows] for f in fields ])
+    def _assign(self,data,idx,value):
+        rows,fields = idx
+        for i,f in enumerate(fields):
+            column = data[f]
+            if callable(value):
+                column[rows] = value(column[rows])
+            else:
+                column[rows] = value[...,i] if numpy.ndim(value) == 2 else value
+    def add_field(self, field, default, dtype=None):
+        """Add new column called 'field' and set its value to 'default'. It can be vector or scalar (it will be broadcast).
+           Column has type 'dtype', if not given it is derived from 'default'.
+        """
+        column = numpy.empty(len(self), dtype=numpy.asarray(default).dtype if dtype is None else dtype)
+        column[:] = default
+        self.fields = self.fields+(field,)
+        self.columns = Columns(self.fields, self.columns.arrays+(column,))
+    def retain_fields(self, fields):
+        """Keep column specified in 'fields', others are discarded. The data are not copied."""
+        if any(f not in self.fields for f in fields):
+            raise ValueError('some fields not in this dataset')
+        self.fields = tuple(fields)
+        self.columns = self.columns.project(self.fields)
+        for f in [f for f in self.indexes if f not in fields]:
+            del self.indexes[f]
+    @instrument('Table.save')
+    def save(self,h5,compression=None,complevel=None,chunkshape=None):
+        """Save the content in 'h5' group, every column is stored as separate array.
+           See Table.save, 'chunkshape' is the shape of the chunk of a column.
+        """
+        h5.store('fields', self.fields, compression=False)
+        for f,a in zip(self.fields,self.columns.arrays):
+            h5.store('columns/%s' % f, a, compression=compression, complevel=complevel, chunkshape=chunkshape)
+            note(bytes_written=a.nbytes)
+    @instrument('Table.append_to')
+    def append_to(self,h5,key=None,compression=None,complevel=None,chunkshape=None):
+        """Append the rows to the table stored in 'h5' group, every column as extendable array (see Table.append_to)."""
+        if key is not None:
+            h5 = h5.child(key)
+        if 'columns' not in h5:
+            for f,a in zip(self.fields,self.columns.arrays):
+                h5.store('columns/%s' % f, a, compression=compression, complevel=complevel, chunkshape=chunkshape, extendable=True)
+            h5.store('fields', self.fields, compression=False)
+        else:
+            nodes = [ _extendable(h5, self.fields, 'columns/%s' % f, a.dtype) for f,a in zip(self.fields,self.columns.arrays) ]
+            for node,a in zip(nodes,self.columns.arrays):
+                node.append(a)
+        note(bytes_written=sum(a.nbytes for a in self.columns.arrays))
+        return len(self) if not self.fields else h5._node('columns/%s' % self.fields[0]).nrows
+
+    def save_npy(self,path):
+        """Save the content in directory 'path', every column as raw NumPy file (see Table.save_npy)."""
+        from numpy import save
+        from os.path import join
+        path = _npy_dir(path,'columns',self.fields)
+        for i,a in enumerate(self.columns.arrays):
+            save(join(path,'%d.npy' % i), a)
+
+class GroupBy(object):
+    """Rows of the table grouped by value of the field, see Table.groupby.
+
+    Groups are found by sorting the keys once, every aggregation is then a
+    single vectorized reduction over the sorted values.
+
+    Parameters
+    ----------
+    table : dataset.Table
+        the table to group
+    field : string
+        the field to group by
+    predicate : dataset.Predicate
+        only rows matching the predicate are grouped
+
+    """
+    aggregations = ('count','sum','mean','min','max')
+    def __init__(self, table, field, predicate=None):
+        table._check_fields((field,))
+        self.table = table
+        self.field = field
+        self.rows = table._match(predicate)
+        self.keys,self.inverse = numpy.unique(table._column(field)[self.rows], return_inverse=True)
+        self._order = None
+    def __len__(self):
+        return len(self.keys)
+    def counts(self):
+        """return number of rows of each group"""
+        return numpy.bincount(self.inverse, minlength=len(self.keys))
+    def _sorted(self, f):
+        """return values of field 'f' sorted by group and start of each group"""
+        if self._order is None:
+            self._order = numpy.argsort(self.inverse, kind='mergesort')
+            self._starts = numpy.concatenate(([0],numpy.cumsum(self.counts())[:-1]))
+        return self.table._column(f)[self.rows][self._order],self._starts
+    def reduce(self, op, f):
+        """return aggregation 'op' (one of 'aggregations') of field 'f' for each group"""
+        if op == 'count':
+            return self.counts()
+        if op not in self.aggregations:
+            raise ValueError('unknown aggregation (%s)' % op)
+        self.table._check_fields((f,))
+        if not len(self.keys):
+            return self.table._column(f)[0:0]
+        values,starts = self._sorted(f)
+        if op == 'mean':
+            return numpy.add.reduceat(values, starts) / self.counts().astype(float)
+        return {'sum':numpy.add,'min':numpy.minimum,'max':numpy.maximum}[op].reduceat(values, starts)
+    def agg(self, **aggregations):
+        """Aggregate the groups, return new Table with the group key and aggregated fields.
+
+        Parameters
+        ----------
+        count : boolean
+            add field 'count' with number of rows in each group
+        sum, mean, min, max : string or tuple
+            field(s) to aggregate, result is called '<field>_<aggregation>'
+
+        """
+        unknown = [ op for op in aggregations if op not in self.aggregations ]
+        if unknown:
+            raise ValueError('unknown aggregations (%s)' % unknown)
+        fields,arrays = [self.field],[self.keys]
+        for op in self.aggregations:
+            spec = aggregations.get(op)
+            if not spec:
+                continue
+            if op == 'count':
+                fields.append('count')
+                arrays.append(self.counts())
+                continue
+            for f in ((spec,) if isinstance(spec,basestring) else spec):
+                fields.append('%s_%s' % (f,op))
+                arrays.append(self.reduce(op,f))
+        return self.table._from_columns(fields,arrays)
+
+class Query(object):
+    """Deferred chain of operations on the table, see Table.query.
+
+    Steps are only recorded, the plan is optimized and executed by 'collect':
+    filters not depending on fields updated by preceding 'set' are merged into
+    single predicate evaluated against the table (so indexes apply), orderings
+    of unmodified fields are applied to row numbers, and only the fields needed
+    by the remaining steps and the result are gathered, by one fancy-index.
+    Remaining steps then run on the gathered rows in the recorded order.
+
+    Steps depending on the count or order of rows ('set' of vector or callable
+    value, predicates with array operands, plain callables) are barriers, no
+    filter or ordering is moved ahead of them.
+
+    Parameters
+    ----------
+    table : dataset.Table
+        the table to query
+
+    """
+    def __init__(self, table):
+        self.table = table
+        self.steps = []
+    def where(self, predicate):
+        """Keep rows matching 'predicate'. Return self."""
+        self.steps.append(('where',predicate))
+        return self
+    def project(self, *fields):
+        """Keep only 'fields' in given order. Return self."""
+        self.steps.append(('project',fields))
+        return self
+    def order(self, field):
+        """Order rows by 'field', the sort is stable. Return self."""
+        self.steps.append(('order',field))
+        return self
+    def set(self, fields, value, predicate=None):
+        """Set 'fields' of rows matching 'predicate' (all if None) to 'value' (see Table.set_fields). Return self."""
+        fields = (fields,) if isinstance(fields,basestring) else tuple(fields)
+        self.steps.append(('set',predicate,fields,value))
+        return self
+    def _plan(self):
+        """return (scan predicate, orders, gathered fields, remaining steps, result fields)"""
+        visible = self.table.fields
+        dirty,scan,orders,post = set(),[],[],[]
+        needed,everything,barrier = set(),False,False
+        def check(fields):
+            err = [f for f in fields if f not in visible]
+            if err:
+                raise ValueError('some fields not in this query (%s)' % err)
+        for step in self.steps:
+            kind = step[0]
+            if kind == 'project':
+                check(step[1])
+                visible = tuple(step[1])
+            elif kind == 'order':
+                check((step[1],))
+                if barrier or step[1] in dirty or any(s[0] == 'order' for s in post):
+                    post.append(step)
+                    needed.add(step[1])
+                else:
+                    orders.append(step[1])
+            elif kind == 'where':
+                refs = _refs(step[1])
+                if refs is not None:
+                    check(refs)
+                rowwise = _rowwise(step[1])
+                if callable(step[1]) and not barrier and (not dirty if refs is None else not (refs & dirty)) \
+                        and (rowwise or not (scan or orders or post)):
+                    scan.append(step[1])
+                    continue
+                post.append(step)
+                barrier = barrier or not rowwise
+                if refs is None:
+                    everything = True
+                else:
+                    needed.update(refs)
+            else:
+                refs = _refs(step[1]) if step[1] is not None else frozenset()
+                check(step[2] + tuple(refs or ()))
+                post.append(step)
+                dirty.update(step[2])
+                needed.update(step[2])
+                if callable(step[3]) or numpy.ndim(step[3]) or not _rowwise(step[1]):
+                    barrier = True
+                if refs is None:
+                    everything = True
+                else:
+                    needed.update(refs)
+        predicate = None if not scan else scan[0] if len(scan) == 1 else Conj(*scan)
+        if everything:
+            needed.update(self.table.fields)
+        gather = tuple(visible) + tuple(f for f in self.table.fields if f in needed and f not in visible)
+        return predicate,orders,gather,post,tuple(visible)
+    def explain(self):
+        """Return description of the optimized plan."""
+        predicate,orders,gather,post,fields = self._plan()
+        lines = [ 'scan %r' % self.table ]
+        if predicate is not None:
+            lines.append('  filter %r' % predicate)
+        lines.extend('  order by %s' % f for f in orders)
+        lines.append('  gather %s' % ','.join(gather))
+        for step in post:
+            if step[0] == 'where':
+                lines.append('  filter %r' % (step[1],))
+            elif step[0] == 'order':
+                lines.append('  order by %s' % step[1])
+            else:
+                lines.append('  set %s = %r%s' % (','.join(step[2]), step[3],
+                             '' if step[1] is None else ' where %r' % (step[1],)))
+        if gather != fields:
+            lines.append('  project %s' % ','.join(fields))
+        return '\n'.join(lines)
+    def collect(self):
+        """Execute the plan. Return new Table."""
+        t = self.table
+        predicate,orders,gather,post,fields = self._plan()
+        columns = None if gather == t.fields else gather
+        if t._is_lazy():
+            result = t.select(predicate, fields=columns, retdset=True)
+            post = [ ('order',f) for f in orders ] + post
+        else:
+            rows = t._get_rows(predicate)
+            for f in orders:
+                rows = t._sort_rows(rows,f)
+            fldidx,names = t._get_columns(columns)
+            result = t._wrap(t._gather(rows,fldidx,t.workers),names)
+            if any(s[0] == 'set' for s in post) and not isinstance(rows,numpy.ndarray):
+                # gathered by slice, rows are a view of the table
+                result = result._copy()
+        for step in post:
+            if step[0] == 'where':
+                result = result.select(step[1], retdset=True)
+            elif step[0] == 'order':
+                result = result.select(None, order=step[1], retdset=True)
+            else:
+                result.set_fields(step[1], step[2], step[3])
+        if result.fields != fields:
+            result.retain_fields(fields)
+        return result
+
+def _refs(predicate):
+    """return fields referenced by 'predicate', None if unknown"""
+    if isinstance(predicate,Predicate):
+        return predicate.refs()
+    return None if callable(predicate) else frozenset()
+
+def _rowwise(predicate):
+    """True if 'predicate' (None for all rows) matches row by row, independently of count and order of rows.
+       Plain callable gets whole frame, so it may use column-wide values and is not considered row-wise.
+    """
+    if isinstance(predicate,Predicate):
+        return predicate._blockable()
+    return predicate is None
 
 ## convivence method for compsoting coditions.
 class Predicate(object):
+    __slots__ = ('_kernel',)
     def __call__(self,arg, fnc):
         raise Exception('not implementd')
     def __and__(self, other):
@@ -404,50 +1811,146 @@ class Predicate(object):
         return Xor(self,other)
     def __eq__(self, other):
         return Equ(self,other)
+    def compile(self):
+        """Return the predicate fused into single kernel (see CompiledPredicate). The kernel is cached."""
+        kernel = getattr(self,'_kernel',None)
+        if kernel is None:
+            kernel = self._kernel = CompiledPredicate(self)
+        return kernel
+    def _expr(self, kernel):
+        """return numexpr expression of the predicate, names are registered in 'kernel'.
+           None if the predicate can not be expressed by numexpr."""
+        return None
+    def _blockable(self):
+        """True if the predicate can be evaluated on row blocks independently"""
+        return True
+    def refs(self):
+        """Return set of fields the predicate depends on, None if unknown."""
+        return None
+    def __getstate__(self):
+        return dict( (k,getattr(self,k)) for c in type(self).__mro__ for k in getattr(c,'__slots__',())
+                     if k != '_kernel' and hasattr(self,k) )
+    def __setstate__(self, state):
+        for k,v in state.iteritems():
+            setattr(self,k,v)
 
 class Term(Predicate):
+    __slots__ = ('field','value')
+    op = None
     def __init__(self, field,value):
         self.value = value
         self.field = field
+    def __repr__(self):
+        if self.op is None:
+            return '%s(%s,%r)' % (self.__class__.__name__, self.field, self.value)
+        return '(%s %s %r)' % (self.field, self.op, self.value)
+    def refs(self):
+        return frozenset((self.field,))
+    def _expr(self, kernel):
+        if self.op is None:
+            return None
+        return '(%s %s %s)' % (kernel.field(self.field), self.op, kernel.value(self.value))
+    def _blockable(self):
+        return numpy.ndim(self.value) == 0
+    def _range(self, keys, value):
+        """return list of (start,stop) ranges of sorted 'keys' matching the term, None if index does not apply"""
+        return None
+    def _ranges(self, keys, valid):
+        """return ranges of sorted 'keys' matching the term, NaNs start at position 'valid'.
+           None if the term can not be resolved by index."""
+        if not self._blockable():
+            return None
+        ranges = self._range(keys,self.value)
+        if ranges is None:
+            return None
+        if self.value != self.value:
+            return []
+        return [(lo,min(hi,valid)) for lo,hi in ranges]
 class Always(Term):
+    __slots__ = ()
     def __call__(self, arg, fnc):
         a = fnc(arg,self.field)
         return a==a
+    def _expr(self, kernel):
+        f = kernel.field(self.field)
+        return '(%s == %s)' % (f,f)
 class Never(Term):
+    __slots__ = ()
     def __call__(self, arg, fnc):
         a = fnc(arg,self.field)
         return a!=a
+    def _expr(self, kernel):
+        f = kernel.field(self.field)
+        return '(%s != %s)' % (f,f)
 class Lt(Term):
+    __slots__ = ()
+    op = '<'
     def __call__(self,arg, fnc):
         return fnc(arg,self.field) < self.value
+    def _range(self, keys, value):
+        return [(0,keys.searchsorted(value,'left'))]
 class Gt(Term):
+    __slots__ = ()
+    op = '>'
     def __call__(self,arg, fnc):
         return fnc(arg,self.field) > self.value
+    def _range(self, keys, value):
+        return [(keys.searchsorted(value,'right'),len(keys))]
 class Le(Term):
+    __slots__ = ()
+    op = '<='
     def __call__(self,arg, fnc):
         return fnc(arg,self.field) <= self.value
+    def _range(self, keys, value):
+        return [(0,keys.searchsorted(value,'right'))]
 class Ge(Term):
+    __slots__ = ()
+    op = '>='
     def __call__(self,arg, fnc):
         return fnc(arg,self.field) >= self.value
+    def _range(self, keys, value):
+        return [(keys.searchsorted(value,'left'),len(keys))]
 class Eq(Term):
+    __slots__ = ()
+    op = '=='
     def __call__(self,arg, fnc):
         return fnc(arg,self.field) == self.value
+    def _range(self, keys, value):
+        return [(keys.searchsorted(value,'left'),keys.searchsorted(value,'right'))]
 class Ne(Term):
+    __slots__ = ()
+    op = '!='
     def __call__(self,arg, fnc):
         return fnc(arg,self.field) != self.value
 class And(Term):
+    __slots__ = ()
     def __call__(self,arg, fnc):
         return fnc(arg,self.field) & self.value
 class Or(Term):
+    __slots__ = ()
     def __call__(self,arg, fnc):
         return fnc(arg,self.field) | self.value
 class In(Term):
+    __slots__ = ()
+    maxterms = 32
     def __call__(self,arg, fnc):
-        from operator import or_
         d = fnc(arg,self.field) if callable(fnc) else fnc
         return reduce(or_, (i==d for i in self.value))
+    def _expr(self, kernel):
+        values = list(self.value)
+        if not values or len(values) > self.maxterms:
+            return None
+        f = kernel.field(self.field)
+        return '(%s)' % ' | '.join('(%s == %s)' % (f,kernel.value(v)) for v in values)
+    def _blockable(self):
+        return True
+    def _ranges(self, keys, valid):
+        ranges = [ Eq(self.field,v)._ranges(keys,valid) for v in set(self.value) ]
+        return None if None in ranges else [r for rs in ranges for r in rs]
 
 class Binary(Predicate):
+    __slots__ = ('preds','reduction')
+    op = None
     def __init__(self, reduction, *args):
         super(Binary, self).__init__()
         argsg = (a.preds if isinstance(a,self.__class__) else (a,) for a in args)
@@ -455,23 +1958,102 @@ class Binary(Predicate):
         self.reduction = reduction if reduction else tuple
     def __call__(self, arg, fnc):
         return reduce(self.reduction, (p(arg,fnc) if callable(p) else p for p in self.preds))
+    def __repr__(self):
+        if self.op is None:
+            return '%s(%s)' % (self.__class__.__name__, ', '.join(repr(p) for p in self.preds))
+        return '(%s)' % (' %s ' % self.op).join(repr(p) for p in self.preds)
+    def refs(self):
+        refs = frozenset()
+        for p in self.preds:
+            r = _refs(p)
+            if r is None:
+                return None
+            refs |= r
+        return refs
+    def _expr(self, kernel):
+        if self.op is None or not all(isinstance(p,Predicate) for p in self.preds):
+            return None
+        exprs = [ p._expr(kernel) for p in self.preds ]
+        return None if None in exprs else '(%s)' % (' %s ' % self.op).join(exprs)
+    def _blockable(self):
+        return all(p._blockable() if isinstance(p,Predicate) else not callable(p) and numpy.ndim(p) == 0
+                   for p in self.preds)
 class Conj(Binary):
+    __slots__ = ()
+    op = '&'
     def __init__(self, *args):
-        from operator import and_
         super(Conj, self).__init__(and_,*args)
 class Dis(Binary):
+    __slots__ = ()
+    op = '|'
     def __init__(self, *args):
-        from operator import or_
         super(Dis, self).__init__(or_,*args)
 class Xor(Binary):
+    __slots__ = ()
     def __init__(self, *args):
-        from operator import xor
         super(Xor, self).__init__(xor,*args)
 class Equ(Binary):
+    __slots__ = ()
     def __init__(self, *args):
-        from operator import eq
         super(Equ, self).__init__(eq,*args)
 
+class CompiledPredicate(Predicate):
+    """Predicate tree fused into single kernel.
+
+    The tree is translated into one numexpr expression and evaluated in a single
+    pass over the data. When numexpr is not available, or the tree can not be
+    expressed by it, the tree is evaluated by NumPy in blocks of 'blocksize' rows,
+    so the temporaries allocated by single terms never exceed the block.
+
+    Parameters
+    ----------
+    predicate : dataset.Predicate
+        the predicate to compile
+
+    """
+    __slots__ = ('predicate','fields','values','blockable','expr')
+    blocksize = 1<<16
+    def __init__(self, predicate):
+        self.predicate = predicate
+        self.fields = []
+        self.values = []
+        self.blockable = predicate._blockable()
+        self.expr = predicate._expr(self)
+    def field(self, f):
+        """register field 'f' and return its name in the expression"""
+        if f not in self.fields:
+            self.fields.append(f)
+        return 'f%d' % self.fields.index(f)
+    def value(self, v):
+        """register constant 'v' and return its name in the expression"""
+        self.values.append(v)
+        return 'v%d' % (len(self.values)-1)
+    def compile(self):
+        return self
+    def refs(self):
+        return self.predicate.refs()
+    def __call__(self, arg, fnc):
+        if self.expr is not None and numexpr is not None:
+            env = dict(('f%d' % i, fnc(arg,f)) for i,f in enumerate(self.fields))
+            env.update(('v%d' % i, v) for i,v in enumerate(self.values))
+            try:
+                return numexpr.evaluate(self.expr, local_dict=env)
+            except (KeyError,TypeError,ValueError,NotImplementedError):
+                # not supported by numexpr (e.g. dtype of a constant), do not try again
+                self.expr = None
+        return self._blocked(arg, fnc)
+    def _blocked(self, arg, fnc):
+        n = arg.shape[0]
+        if n <= self.blocksize or not self.blockable:
+            return self.predicate(arg, fnc)
+        out = None
+        for start in xrange(0,n,self.blocksize):
+            r = self.predicate(arg[start:start+self.blocksize], fnc)
+            if out is None:
+                out = numpy.empty((n,)+r.shape[1:], dtype=r.dtype)
+            out[start:start+r.shape[0]] = r
+        return out
+
 class Variable(object):
     """Factory object to build an predicate instances.
 
@@ -481,8 +2063,13 @@ class Variable(object):
         a name of the variable
 
     """
+    __slots__ = ('field',)
     def __init__(self, field):
         self.field = field
+    def __getstate__(self):
+        return {'field': self.field}
+    def __setstate__(self, state):
+        self.field = state['field']
     def __lt__(self,other):
         return Lt(self.field,other)
     def __gt__(self,other):
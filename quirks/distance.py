@@ -0,0 +1,126 @@
+"""Vectorized Minkowski distances of points stored in NumPy arrays or Tables.
+
+Points are rows of 2-D arrays, or rows of dataset.Table where 'fields' are
+the coordinates. Distances of order 'p' are computed for whole arrays at once,
+pairwise distances in blocks of rows whose temporaries fit into 'membudget' bytes.
+
+Example:
+    idx,dist = nearest(queries, table, k=5, fields=('x','y'))
+
+"""
+
+membudget = 1<<26
+
+def points(x, fields=None):
+    """Return 2-D float array of points 'x', array-like or Table with coordinates in 'fields' (all if None).
+       Single point may be given as 1-D array.
+    """
+    from numpy import asarray,column_stack,empty
+    from dataset import Table
+    if isinstance(x,Table):
+        fields = x.fields if fields is None else fields
+        if not fields:
+            return empty((len(x),0))
+        return asarray(column_stack([ x._column(f) for f in fields ]), dtype=float)
+    x = asarray(x, dtype=float)
+    return x.reshape(1,-1) if x.ndim == 1 else x
+
+def _norm(diff, p):
+    """return Minkowski norm of order 'p' of float differences 'diff' along last axis, 'diff' is overwritten"""
+    from numpy import abs,sqrt,inf,einsum
+    if p == 2:
+        return sqrt(einsum('...i,...i->...', diff, diff))
+    diff = abs(diff, out=diff)
+    if p == 1:
+        return diff.sum(-1)
+    if p == inf:
+        return diff.max(-1) if diff.shape[-1] else diff.sum(-1)
+    diff **= p
+    return diff.sum(-1) ** (1./p)
+
+def distances(x, Y, p=2, fields=None):
+    """Return distances of order 'p' of point 'x' to every point of 'Y'."""
+    x,Y = points(x,fields).ravel(),points(Y,fields)
+    if len(x) != Y.shape[1]:
+        raise ValueError('points must have same dimension')
+    return _norm(Y - x, p)
+
+def _rows(X, Y, p, budget):
+    """return number of rows of X whose distances to Y fit into 'budget' bytes of temporaries.
+       A row takes one row of the block of distances, for p other than 2 also differences
+       of all coordinates (see _block).
+    """
+    width = len(Y) * (1 if p == 2 else max(Y.shape[1],1) + 1) * 8
+    return max(1, budget // max(width,1))
+
+def _block(X, Y, p, sqnorms=None):
+    """return distances of every point of 'X' to every point of 'Y', the block is the only
+       temporary of size len(X) x len(Y), for p other than 2 also differences of the coordinates"""
+    from numpy import sqrt,dot,einsum
+    if p == 2:
+        # |x-y|^2 = |x|^2 + |y|^2 - 2xy, computed by matrix product updated in place
+        d = dot(X, Y.T)
+        d *= -2
+        d += einsum('ij,ij->i', X, X)[:,None]
+        d += sqnorms[None,:]
+        return sqrt(d.clip(0,None,out=d), out=d)
+    return _norm(X[:,None,:] - Y[None,:,:], p)
+
+def pairwise_blocks(X, Y, p=2, budget=None, fields=None):
+    """Iterate over (start, block) pairs, block holds distances of order 'p' of rows
+       start, start+1, ... of 'X' to all rows of 'Y', its temporaries fit into 'budget' bytes.
+    """
+    from numpy import einsum
+    X,Y = points(X,fields),points(Y,fields)
+    if X.shape[1] != Y.shape[1]:
+        raise ValueError('points must have same dimension')
+    budget = membudget if budget is None else budget
+    sqnorms = einsum('ij,ij->i', Y, Y) if p == 2 else None
+    step = _rows(X, Y, p, budget)
+    for start in xrange(0, len(X), step):
+        yield start, _block(X[start:start+step], Y, p, sqnorms)
+
+def pairwise(X, Y, p=2, budget=None, fields=None):
+    """Return matrix of distances of order 'p' of every point of 'X' to every point of 'Y'.
+
+    Parameters
+    ----------
+    X, Y : array-like [n_points, n_dims] or dataset.Table
+        the points
+    p : float
+        order of Minkowski distance, 'numpy.inf' for Chebyshev distance
+    budget : int
+        bytes of temporaries of one block of rows, defaults to 'membudget'
+    fields : tuple
+        coordinates of points stored in Table
+
+    For p=2 the squares are expanded into matrix product, distances of nearly
+    identical points lose relative precision.
+    """
+    from numpy import empty
+    X,Y = points(X,fields),points(Y,fields)
+    result = empty((len(X),len(Y)))
+    for start,block in pairwise_blocks(X, Y, p, budget):
+        result[start:start+len(block)] = block
+    return result
+
+def nearest(X, Y, k=1, p=2, budget=None, fields=None):
+    """Return indexes and distances of 'k' nearest points of 'Y' to every point of 'X'.
+
+    Distances are computed by blocks (see pairwise), only the 'k' nearest points
+    of each block are kept and sorted. Result are two arrays [len(X), k], or
+    vectors of length 'k' if 'X' is single point given as vector.
+    """
+    from numpy import argpartition,argsort,arange,ndim,empty
+    from dataset import Table
+    single = not isinstance(X,Table) and ndim(X) == 1
+    X,Y = points(X,fields),points(Y,fields)
+    k = min(k,len(Y))
+    idx,dist = empty((len(X),k),dtype=int),empty((len(X),k))
+    for start,block in pairwise_blocks(X, Y, p, budget):
+        rows = arange(len(block))[:,None]
+        top = argpartition(block, k-1, axis=1)[:,:k] if 0 < k < len(Y) else argsort(block, axis=1)[:,:k]
+        order = argsort(block[rows,top], axis=1, kind='mergesort')
+        idx[start:start+len(block)] = top[rows,order]
+        dist[start:start+len(block)] = block[rows,top[rows,order]]
+    return (idx[0],dist[0]) if single else (idx,dist)
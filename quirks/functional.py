@@ -1,28 +1,71 @@
-from operator import *
-from math import *
-from functools import *
+from operator import add,sub
+from math import pow
+from functools import partial
 
 
 def combinator(*fncs):
-    return lambda *args:getitem(
-            reduce(lambda acc,fnc:(fnc(*acc),), 
-                   reversed(fncs), 
-                   args), 0)
+    """Return composition of 'fncs', combinator(f,g,h)(*args) == f(g(h(*args))).
+       Nested combinators are flattened, composition of up to three functions is single closure.
+    """
+    fncs = tuple(i for f in fncs for i in getattr(f,'_combined',(f,)))
+    if len(fncs) == 1:
+        return fncs[0]
+    elif len(fncs) == 2:
+        f,g = fncs
+        composed = lambda *args: f(g(*args))
+    elif len(fncs) == 3:
+        f,g,h = fncs
+        composed = lambda *args: f(g(h(*args)))
+    elif fncs:
+        last,rest = fncs[-1],fncs[-2::-1]
+        def composed(*args):
+            x = last(*args)
+            for f in rest:
+                x = f(x)
+            return x
+    else:
+        composed = lambda *args: args[0]
+    composed._combined = fncs
+    return composed
 
 def flip(f):
     return lambda *a: f(*reversed(a))
 
 class maybe(object):
-    """inspired by haskell's Maybe monad"""
-    def __init__(self, *functions):
+    """inspired by haskell's Maybe monad
+
+    Return result of the first function returning other than None without
+    raising an exception. If 'cache' is set, the function that succeeded is
+    remembered for types of the arguments and tried first next time, use it if
+    the success depends on the types only.
+    """
+    def __init__(self, *functions, **options):
         self.functions = functions
+        self.cache = {} if options.pop('cache',False) else None
+        if options:
+            raise TypeError('unexpected arguments %s' % options.keys())
     def __call__(self, *args, **kwargs):
-        for fnc in self.functions:
+        cached = None
+        if self.cache is not None:
+            key = tuple(map(type,args)) + tuple(sorted((k,type(v)) for k,v in kwargs.iteritems()))
+            cached = self.cache.get(key)
+            if cached is not None:
+                try:
+                    res = self.functions[cached](*args, **kwargs)
+                except Exception:
+                    res = None
+                if res is not None:
+                    return res
+        for i,fnc in enumerate(self.functions):
+            if i == cached:
+                continue
             try:
                 res = fnc(*args, **kwargs)
-            except:
+            except Exception:
                 res = None
             if res is not None:
+                if self.cache is not None:
+                    self.cache[key] = i
                 return res
         return None
 
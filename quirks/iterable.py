@@ -1,5 +1,5 @@
 
-from itertools import *
+from itertools import islice
 
 def isiterable(obj):
     from collections import Iterable
@@ -7,8 +7,7 @@ def isiterable(obj):
 
 
 def itake(n, it):
-    from itertools import izip,imap,count,takewhile
-    return imap(lambda x:x[1],takewhile(lambda x:x[0]<n, izip(count(),it)))    
+    return islice(it, max(n,0))
 
 
 def first(iterable):
@@ -21,3 +20,130 @@ class ensure_iterable(object):
         result = self.function(*args, **kwargs)
         return result if isiterable(result) else (result,)
 
+
+def batched(iterable, size):
+    """Iterate over lists of 'size' consecutive items, the last one may be shorter."""
+    it = iter(iterable)
+    while True:
+        batch = list(islice(it, size))
+        if not batch:
+            return
+        yield batch
+
+def iblocks(iterable, size, dtype=None):
+    """Iterate over NumPy arrays of 'size' consecutive items (rows if items are sequences), the last one may be shorter."""
+    from numpy import array
+    for batch in batched(iterable, size):
+        yield array(batch, dtype=dtype)
+
+def window(iterable, size, step=1):
+    """Iterate over tuples of 'size' consecutive items starting every 'step' items. Incomplete window is dropped."""
+    from collections import deque
+    it = iter(iterable)
+    win = deque(islice(it, size), maxlen=size)
+    if len(win) < size:
+        return
+    yield tuple(win)
+    while True:
+        items = list(islice(it, step))
+        win.extend(items)
+        if len(items) < step:
+            return
+        yield tuple(win)
+
+class _tee(object):
+    """one of iterators returned by tee, 'shared' is [source iterator, buffer, offset, positions, maxsize]"""
+    __slots__ = ('shared','i')
+    def __init__(self, shared, i):
+        self.shared = shared
+        self.i = i
+    def __iter__(self):
+        return self
+    def next(self):
+        it,buf,offset,pos,maxsize = self.shared
+        k = pos[self.i] - offset[0]
+        if k == len(buf):
+            if len(buf) >= maxsize:
+                raise BufferError('tee buffer of %d items is full' % maxsize)
+            buf.append(next(it))
+        item = buf[k]
+        pos[self.i] += 1
+        while buf and min(pos) > offset[0]:
+            buf.popleft()
+            offset[0] += 1
+        return item
+
+def tee(iterable, n=2, maxsize=None):
+    """Return 'n' independent iterators over 'iterable' (see itertools.tee).
+
+    Items are buffered until all iterators consumed them. If set, at most
+    'maxsize' items are buffered, BufferError is raised by the iterator that
+    gets further ahead of the others. The iterator is not exhausted by the
+    error, it continues once the others consumed the buffered items.
+    """
+    from itertools import tee as _itee
+    from collections import deque
+    if maxsize is None:
+        return _itee(iterable, n)
+    shared = [iter(iterable), deque(), [0], [0]*n, maxsize]
+    return tuple(_tee(shared, i) for i in xrange(n))
+
+def _call(args):
+    """apply function to item in a pool worker, return success flag and result or exception"""
+    fnc,item = args
+    try:
+        return True,fnc(item)
+    except Exception, e:
+        return False,e
+
+def pimap(fnc, iterable, workers=None, processes=False, ordered=True, buffersize=None):
+    """Iterate over fnc(item) for items of 'iterable' evaluated by pool of 'workers' threads.
+
+    Parameters
+    ----------
+    workers : int
+        size of the pool, defaults to number of CPUs
+    processes : boolean
+        if True pool of processes is used, 'fnc' and items must be picklable
+    ordered : boolean
+        if True results are in order of 'iterable', otherwise as they complete
+    buffersize : int
+        at most 'buffersize' items (2*workers by default) are submitted ahead of
+        the consumer, so 'iterable' is read only as fast as results are consumed
+
+    Exception raised by 'fnc' is re-raised by the iterator. The pool is terminated
+    when the iterator is exhausted or closed.
+    """
+    from multiprocessing import Pool,cpu_count
+    from multiprocessing.pool import ThreadPool
+    from collections import deque
+    from Queue import Queue
+    workers = workers or cpu_count()
+    buffersize = buffersize or 2*workers
+    pool = (Pool if processes else ThreadPool)(workers)
+    it = iter(iterable)
+    try:
+        if ordered:
+            pending = deque( pool.apply_async(fnc,(item,)) for item in islice(it,buffersize) )
+            while pending:
+                result = pending.popleft().get()
+                pending.extend( pool.apply_async(fnc,(item,)) for item in islice(it,1) )
+                yield result
+        else:
+            done = Queue()
+            count = 0
+            for item in islice(it,buffersize):
+                pool.apply_async(_call, ((fnc,item),), callback=done.put)
+                count += 1
+            while count:
+                ok,result = done.get()
+                count -= 1
+                if not ok:
+                    raise result
+                for item in islice(it,1):
+                    pool.apply_async(_call, ((fnc,item),), callback=done.put)
+                    count += 1
+                yield result
+    finally:
+        pool.terminate()
+        pool.join()
@@ -0,0 +1,47 @@
+"""Lazy import of heavy modules.
+
+Example:
+    numpy = lazy.module('numpy')
+    # numpy is imported on first access of its attribute
+    numpy.arange(10)
+
+"""
+
+import sys
+from types import ModuleType
+
+class LazyModule(ModuleType):
+    """Proxy of module 'name', the module is imported on first access of its attribute.
+       Attributes of the module are then copied to the proxy, so further access is plain
+       attribute lookup.
+    """
+    def __init__(self, name):
+        super(LazyModule, self).__init__(name)
+    def _load(self):
+        """import the module, return it"""
+        __import__(self.__name__)
+        module = sys.modules[self.__name__]
+        self.__dict__.update(module.__dict__)
+        return module
+    def __getattr__(self, name):
+        if name.startswith('__') and name.endswith('__'):
+            raise AttributeError(name)
+        return getattr(self._load(), name)
+    def __dir__(self):
+        return dir(self._load())
+    def __repr__(self):
+        return '<lazy module %r>' % self.__name__
+
+def module(name):
+    """Return module 'name' if it is already imported, otherwise its lazy proxy."""
+    return sys.modules.get(name) or LazyModule(name)
+
+def available(name):
+    """True if module 'name' can be imported, top-level package is looked up without importing it."""
+    from pkgutil import find_loader
+    if name in sys.modules:
+        return True
+    try:
+        return find_loader(name.split('.')[0]) is not None
+    except ImportError:
+        return False
@@ -0,0 +1,123 @@
+"""Opt-in instrumentation of Table and H5Node operations.
+
+Instrumented calls are reported to hooks registered by 'add_hook' as Event
+instances carrying wall time and counters (rows scanned and returned, bytes
+read or written, bytes of temporary arrays). When no hook is registered the
+instrumented call costs one extra function call.
+
+Example:
+    with Profiler() as prof:
+        data.select(data.size > 10)
+    print prof.report()
+
+"""
+
+import threading
+
+_hooks = []
+_local = threading.local()
+
+class Event(object):
+    """Record of one instrumented call.
+
+    Parameters
+    ----------
+    name : string
+        name of the operation, e.g. 'Table.select'
+    parent : Event
+        enclosing instrumented call of the same thread or None
+
+    """
+    def __init__(self, name, parent=None):
+        self.name = name
+        self.parent = parent
+        self.depth = parent.depth + 1 if parent is not None else 0
+        self.seconds = None
+        self.counters = {}
+    def __repr__(self):
+        counters = ','.join('%s=%s' % i for i in sorted(self.counters.iteritems()))
+        return '<Event(%s,seconds=%s%s)>' % (self.name, self.seconds, ',' + counters if counters else '')
+
+def add_hook(fnc):
+    """Call 'fnc(event)' when an instrumented call finishes."""
+    _hooks.append(fnc)
+
+def remove_hook(fnc):
+    """Unregister hook 'fnc'."""
+    _hooks.remove(fnc)
+
+def enabled():
+    """True if some hook is registered."""
+    return bool(_hooks)
+
+def note(**counters):
+    """Add 'counters' to the innermost instrumented call of this thread, ignored if there is none."""
+    event = getattr(_local, 'event', None)
+    if event is not None:
+        for k,v in counters.iteritems():
+            event.counters[k] = event.counters.get(k,0) + v
+
+def instrument(name):
+    """Decorator reporting calls of the function as events called 'name'."""
+    from functools import wraps
+    from time import time
+    def decorator(fnc):
+        @wraps(fnc)
+        def wrapper(*args, **kwargs):
+            if not _hooks:
+                return fnc(*args, **kwargs)
+            parent = getattr(_local, 'event', None)
+            event = _local.event = Event(name, parent)
+            start = time()
+            try:
+                return fnc(*args, **kwargs)
+            finally:
+                event.seconds = time() - start
+                _local.event = parent
+                for hook in list(_hooks):
+                    hook(event)
+        return wrapper
+    return decorator
+
+class Profiler(object):
+    """Context manager aggregating events reported while it is active.
+
+    Parameters
+    ----------
+    keep : boolean
+        if True every event is kept in 'events', otherwise only aggregated in 'stats'
+
+    'stats' maps operation name to dict with 'calls', 'seconds', 'max_seconds'
+    and sums of the counters.
+    """
+    def __init__(self, keep=False):
+        self.keep = keep
+        self.events = []
+        self.stats = {}
+        self._lock = threading.Lock()
+    def __enter__(self):
+        add_hook(self)
+        return self
+    def __exit__(self, *exc_info):
+        remove_hook(self)
+        return False
+    def __call__(self, event):
+        with self._lock:
+            if self.keep:
+                self.events.append(event)
+            s = self.stats.get(event.name)
+            if s is None:
+                s = self.stats[event.name] = {'calls':0,'seconds':0.,'max_seconds':0.}
+            s['calls'] += 1
+            s['seconds'] += event.seconds
+            s['max_seconds'] = max(s['max_seconds'], event.seconds)
+            for k,v in event.counters.iteritems():
+                s[k] = s.get(k,0) + v
+    def report(self):
+        """Return the statistics formatted as table, slowest operations first."""
+        lines = [ '%-20s %8s %12s %12s  %s' % ('operation','calls','seconds','max','counters') ]
+        for name,s in sorted(self.stats.iteritems(), key=lambda i: -i[1]['seconds']):
+            counters = ' '.join('%s=%s' % (k,v) for k,v in sorted(s.iteritems())
+                                if k not in ('calls','seconds','max_seconds'))
+            lines.append('%-20s %8d %12.6f %12.6f  %s' % (name, s['calls'], s['seconds'], s['max_seconds'], counters))
+        return '\n'.join(lines)
@@ -0,0 +1,188 @@
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+import numpy
+
+from quirks.dataset import H5Node,Table,ColumnTable,Variable
+
+def table(n, cls=Table):
+    return cls(data=numpy.arange(2*n).reshape(n,2), fields=('a','b'))
+
+class TestAppend(unittest.TestCase):
+    def test_append_after_delete(self):
+        for cls in (Table,ColumnTable):
+            t = table(0,cls).extend([ [[2*i,2*i+1]] for i in xrange(20) ])
+            expected = numpy.vstack((t.data[10:15],[[99,99]]))
+            # delete keeps the selected rows, they are a view in the middle of the buffer
+            del t[10:15]
+            t.append([[99,99]])
+            numpy.testing.assert_array_equal(t.data, expected)
+    def test_add_field_keeps_add_copying(self):
+        t,u = table(4),table(3)
+        t.add_field('c',0)
+        u.add_field('c',1)
+        r = t + u
+        self.assertIsNot(r,t)
+        self.assertEqual((len(t),len(r)),(4,7))
+    def test_add_appends_in_place_if_growable(self):
+        t,u = table(4).reserve(16),table(3)
+        self.assertIs(t + u,t)
+        self.assertEqual(len(t),7)
+
+class TestPickle(unittest.TestCase):
+    def test_variable_and_predicate(self):
+        for protocol in xrange(pickle.HIGHEST_PROTOCOL+1):
+            self.assertEqual(pickle.loads(pickle.dumps(Variable('a'),protocol)).field, 'a')
+            p = pickle.loads(pickle.dumps((Variable('a') > 1) & (Variable('b') < 2),protocol))
+            self.assertEqual(repr(p), '((a > 1) & (b < 2))')
+
+class TestIndex(unittest.TestCase):
+    def setUp(self):
+        random = numpy.random.RandomState(0)
+        data = random.randint(0,10,(1000,2)).astype(float)
+        data[::7,0] = numpy.nan
+        self.t = Table(data=data, fields=('a','b'))
+        self.indexed = Table(data=data, fields=('a','b'))
+        self.indexed.create_index('a')
+    def check(self, predicate):
+        numpy.testing.assert_array_equal(self.indexed.select(predicate), self.t.select(predicate))
+    def test_terms(self):
+        t = self.t
+        for v in (-1,0,3.,5,9,10,numpy.nan):
+            for p in (t.a < v, t.a <= v, t.a > v, t.a >= v, t.a == v, t.a != v):
+                self.check(p)
+    def test_array_operand_in_rest(self):
+        t = self.t
+        vec = numpy.linspace(0,10,len(t))
+        self.check((t.a > 5) & (t.b < vec))
+        self.check((t.a > 5) & (numpy.arange(len(t)) % 2 == 0))
+
+class TestSetFields(unittest.TestCase):
+    def test_returns_matched_count(self):
+        t = Table(data=numpy.arange(2000.).reshape(1000,2), fields=('a','b'))
+        expected = int((t._column('a') < 252).sum())
+        self.assertEqual(t.set_fields(t.a < 252, ('b',), 0), expected)
+        self.assertEqual(ColumnTable(data=t.data, fields=t.fields).set_fields(t.a < 252, ('b',), 0), expected)
+        t.create_index('a')
+        self.assertEqual(t.set_fields(t.a < 252, ('b',), 0), expected)
+        self.assertEqual(t.set_fields(slice(10,20), ('b',), 0), 10)
+        self.assertEqual(t.set_fields(None, ('b',), 0), 1000)
+
+class TestParallel(unittest.TestCase):
+    def setUp(self):
+        random = numpy.random.RandomState(0)
+        self.t = Table(data=random.rand(100000,2), fields=('a','b'))
+        self.t.shardsize = 1<<12
+    def test_array_operands(self):
+        t = self.t
+        mask = numpy.arange(len(t)) % 3 == 0
+        vec = numpy.linspace(0,1,len(t))
+        for pred in ((t.a > .3) & mask, t.a < vec):
+            serial = t.select(pred)
+            numpy.testing.assert_array_equal(t.select(pred, workers=4), serial)
+            # kernel still evaluates the same after parallel call
+            numpy.testing.assert_array_equal(t.select(pred), serial)
+    def test_callable(self):
+        t = self.t
+        above_mean = lambda x,f: f(x,'a') > f(x,'a').mean()
+        for pred in (above_mean, (t.b < .5) & above_mean):
+            numpy.testing.assert_array_equal(t.select(pred, workers=4), t.select(pred))
+    def test_scalar_operands(self):
+        t = self.t
+        pred = (t.a > .3) & (t.b < .5)
+        numpy.testing.assert_array_equal(t.select(pred, workers=4), t.select(pred))
+
+class TestQuery(unittest.TestCase):
+    def setUp(self):
+        self.t = Table(data=numpy.array([[6,1],[2,2],[5,3],[1,4],[4,5],[3,6]],dtype=float), fields=('a','b'))
+    def eager(self, steps):
+        t = self.t._copy()
+        for step in steps:
+            if step[0] == 'where':
+                t = t.select(step[1], retdset=True)
+            elif step[0] == 'order':
+                t = t.select(None, order=step[1], retdset=True)
+            else:
+                t.set_fields(None, (step[1],), step[2])
+        return t
+    def check(self, *steps):
+        q = self.t.query()
+        for step in steps:
+            getattr(q,step[0])(*step[1:])
+        numpy.testing.assert_array_equal(q.collect().data, self.eager(steps).data)
+    def test_vector_set_is_barrier(self):
+        self.check(('set','b',numpy.arange(6.).reshape(6,1)), ('where',self.t.a > 3))
+    def test_callable_set_is_barrier(self):
+        self.check(('set','b',lambda x: x.cumsum(0)), ('order','a'))
+    def test_array_predicate_is_barrier(self):
+        self.check(('where',self.t.b > 1), ('where',self.t.a < numpy.arange(5.)), ('order','a'))
+    def test_callable_where_is_barrier(self):
+        t = self.t
+        above_mean = lambda x,f: f(x,'b') > f(x,'b').mean()
+        self.check(('where',t.a > 4), ('where',above_mean))
+        self.check(('where',above_mean), ('where',t.a > 2))
+    def test_scalar_set_is_reordered(self):
+        t = self.t
+        self.check(('set','b',0.), ('where',t.a > 3), ('order','a'))
+        predicate,orders,gather,post,fields = t.query().set('b',0.).where(t.a > 3).order('a')._plan()
+        self.assertEqual((repr(predicate),orders,len(post)),(repr(t.a > 3),['a'],1))
+
+class TestH5Node(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.h5 = H5Node(os.path.join(self.dir,'test.h5'))
+        self.h5.cachesize = 2
+    def tearDown(self):
+        self.h5.h5.close()
+        shutil.rmtree(self.dir)
+    def test_delete_after_eviction(self):
+        h5 = self.h5
+        h5['grp/x'] = numpy.arange(3)
+        g = h5['grp']
+        self.assertTrue('x' in g)
+        for i in xrange(4):
+            h5['other%d' % i] = i
+            h5['other%d' % i]
+        self.assertNotIn('/grp', h5._cache)
+        del h5['grp/x']
+        self.assertFalse('x' in g)
+    def test_chunked_set_fields_count(self):
+        t = Table(data=numpy.arange(2000.).reshape(1000,2), fields=('a','b'))
+        t.save(self.h5['table'])
+        chunked = Table(h5=self.h5.child('table'), chunksize=100)
+        self.assertEqual(chunked.set_fields(t.a < 252, ('b',), 0), 126)
+    def test_map_workers(self):
+        for i in xrange(4):
+            self.h5['t%d' % i] = numpy.arange(i+2)
+        self.assertEqual(self.h5.map(len, workers=2), [ ('t%d' % i, i+2) for i in xrange(4) ])
+    def test_chunked_array_operands(self):
+        random = numpy.random.RandomState(0)
+        t = Table(data=random.randint(0,10,(5000,2)).astype(float), fields=('a','b'))
+        t.save(self.h5['table'])
+        chunked = Table(h5=self.h5.child('table'), chunksize=777)
+        vec = numpy.linspace(0,10,len(t))
+        mask = numpy.arange(len(t)) % 3 == 0
+        for pred in (t.b < vec, (t.a > 4) & mask):
+            numpy.testing.assert_array_equal(chunked.select(pred), t.select(pred))
+            numpy.testing.assert_array_equal(chunked.groupby('a',pred).counts(), t.groupby('a',pred).counts())
+        self.assertEqual(chunked.set_fields(t.b < vec, ('a',), -1), t.set_fields(t.b < vec, ('a',), -1))
+        numpy.testing.assert_array_equal(chunked._read(), t.data)
+    def test_scalar(self):
+        h5 = self.h5
+        h5['i'] = 5
+        h5['f'] = 2.5
+        h5['a'] = numpy.array([7])
+        self.assertEqual((h5['i'],h5['f'],h5['a']), (5,2.5,7))
+    def test_closed_handle_is_looked_up(self):
+        h5 = self.h5
+        h5['grp/x'] = numpy.arange(3)
+        g = h5['grp']
+        self.assertTrue('x' in g)
+        h5.h5.getNode('/grp/x')._f_remove()
+        h5.h5.createArray('/grp','x',numpy.arange(5))
+        self.assertEqual(len(g['x']),5)
+
+if __name__ == '__main__':
+    unittest.main()
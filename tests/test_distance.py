@@ -0,0 +1,31 @@
+import unittest
+import numpy
+
+from quirks.distance import distances,pairwise,nearest,_rows
+
+class TestDistance(unittest.TestCase):
+    def setUp(self):
+        random = numpy.random.RandomState(0)
+        self.X,self.Y = random.randn(50,3),random.randn(70,3)
+    def brute(self, p):
+        diff = numpy.abs(self.X[:,None,:] - self.Y[None,:,:])
+        if p == numpy.inf:
+            return diff.max(-1)
+        return (diff**p).sum(-1) ** (1./p)
+    def test_pairwise(self):
+        for p in (1,2,3,numpy.inf):
+            expected = self.brute(p)
+            numpy.testing.assert_allclose(pairwise(self.X,self.Y,p), expected)
+            numpy.testing.assert_allclose(pairwise(self.X,self.Y,p,budget=1000), expected)
+            numpy.testing.assert_allclose(distances(self.X[0],self.Y,p), expected[0])
+    def test_nearest(self):
+        idx,dist = nearest(self.X,self.Y,k=3,budget=1000)
+        expected = self.brute(2)
+        numpy.testing.assert_array_equal(idx, numpy.argsort(expected,axis=1,kind='mergesort')[:,:3])
+        numpy.testing.assert_allclose(dist, numpy.sort(expected,axis=1)[:,:3])
+    def test_budget(self):
+        self.assertEqual(_rows(self.X,self.Y,2,70*8*10), 10)
+        self.assertEqual(_rows(self.X,self.Y,1,70*8*4*10), 10)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,22 @@
+import unittest
+
+from quirks.iterable import tee
+
+class TestTee(unittest.TestCase):
+    def test_continue_after_buffer_error(self):
+        a,b = tee(xrange(10), maxsize=3)
+        self.assertEqual([next(a) for i in xrange(3)], [0,1,2])
+        self.assertRaises(BufferError, next, a)
+        self.assertEqual([next(b) for i in xrange(3)], [0,1,2])
+        self.assertEqual([next(a) for i in xrange(3)], [3,4,5])
+        self.assertEqual([next(b) for i in xrange(3)], [3,4,5])
+        self.assertEqual([next(a) for i in xrange(3)], [6,7,8])
+        self.assertRaises(BufferError, next, a)
+        self.assertEqual(list(b), range(6,10))
+        self.assertEqual(list(a), [9])
+    def test_unbounded(self):
+        a,b = tee(xrange(5))
+        self.assertEqual((list(a),list(b)), (range(5),range(5)))
+
+if __name__ == '__main__':
+    unittest.main()